@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the MediaPipe face processor
+Times landmark detection, every _apply_*/_enhance_* effect and the end-to-end
+makeup/enhance actions over sample and synthetic images at several
+resolutions, the cold start of the landmarks CLI and the drift of reused
+video masks, and compares the results against a stored baseline
+"""
+
+import cv2
+import mediapipe as mp
+import numpy as np
+import json
+import sys
+import os
+import time
+import argparse
+import importlib.util
+import inspect
+import platform
+import subprocess
+import threading
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+# Outer eye corners; landmark error is also reported relative to their distance
+LEFT_EYE_CORNER = 33
+RIGHT_EYE_CORNER = 263
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mediapipe-face-processor.py')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Every effect switched on, with non-empty configs (an empty config skips the effect)
+DEFAULT_MAKEUP_CONFIG = {
+    'lipstick': {'color': '#aa2244', 'intensity': 0.6},
+    'eyeshadow': {'color': '#8B4513', 'intensity': 0.4},
+    'blush': {'color': '#FFB6C1', 'intensity': 0.3},
+    'eyeliner': {'color': '#000000', 'thickness': 2},
+    'foundation': {'intensity': 0.3}
+}
+DEFAULT_ENHANCE_CONFIG = {'enhance_eyes': True, 'enhance_nose': True, 'enhance_lips': True}
+
+# A stage is reported as a regression when its p50 grows by more than this factor
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+
+# Reused/warped video masks may sit at most this far from freshly built ones
+MAX_MASK_DRIFT_PX = 1.0
+
+
+def load_processor_module():
+    """Import mediapipe-face-processor.py (its hyphenated name rules out a plain import)"""
+    spec = importlib.util.spec_from_file_location('mediapipe_face_processor', PROCESSOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_call(fn: Callable, repeat: int, setup: Optional[Callable] = None) -> List[float]:
+    """Wall-clock milliseconds of repeat calls to fn
+
+    setup, if given, runs untimed before each call and its result is passed to fn.
+    """
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings: List[float]) -> Dict:
+    """p50/p95/mean of a list of millisecond timings, plus calls per second"""
+    mean = float(np.mean(timings))
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p95_ms': round(float(np.percentile(timings, 95)), 3),
+        'mean_ms': round(mean, 3),
+        'throughput_per_s': round(1000 / mean, 2) if mean else None
+    }
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process right now (Linux /proc), or None elsewhere"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_growth(fn: Callable, args: tuple, interval: float = 0.001) -> Optional[int]:
+    """Highest RSS above the starting level while fn(*args) runs, sampled every interval seconds"""
+    baseline = current_rss_bytes()
+    if baseline is None:
+        fn(*args)
+        return None
+
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], current_rss_bytes())
+            done.wait(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn(*args)
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], current_rss_bytes()) - baseline
+
+
+def measure(fn: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict:
+    """Timing summary plus allocation and RSS figures for one stage
+
+    Allocations come from a separate traced call (tracemalloc sees numpy
+    buffers but not OpenCV's internal ones), so tracing never skews timings.
+    rss_growth_mb is how far resident memory rose above its level at the
+    start of one more call of the stage (sampled every millisecond; memory
+    the allocator already holds from earlier stages is not counted again).
+    """
+    # Warm-up: first calls pay for graph initialization and lazy allocations
+    fn(*((setup(),) if setup else ()))
+
+    row = summarize(time_call(fn, repeat, setup))
+
+    args = (setup(),) if setup else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    row['alloc_peak_kb'] = round(peak / 1024, 1)
+    row['alloc_retained_blocks'] = blocks
+    growth = peak_rss_growth(fn, (setup(),) if setup else ())
+    if growth is not None:
+        row['rss_growth_mb'] = round(growth / (1024 * 1024), 1)
+    return row
+
+
+def load_image(path: str, upscale: float = 1.0) -> Optional[np.ndarray]:
+    """Read an image, optionally enlarged to stand in for high-resolution phone photos"""
+    image = cv2.imread(path)
+    if image is None:
+        print(f"Skipping unreadable image: {path}", file=sys.stderr)
+        return None
+    if upscale != 1.0:
+        image = cv2.resize(image, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+    return image
+
+
+def default_image_paths() -> List[str]:
+    """Sample images shipped in attached_assets/"""
+    paths = []
+    for root, _, files in os.walk(os.path.join(REPO_ROOT, 'attached_assets')):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def resize_to(image: np.ndarray, longest_side: int) -> np.ndarray:
+    """Resize image so its longest side equals longest_side"""
+    scale = longest_side / max(image.shape[:2])
+    size = (max(int(round(image.shape[1] * scale)), 1), max(int(round(image.shape[0] * scale)), 1))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Skin-toned gradient with mild noise; deterministic for a given seed"""
+    rng = np.random.default_rng(seed)
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = np.array([150, 170, 210], dtype=np.float32)  # BGR skin tone
+    shade = 0.85 + 0.15 * np.sin(np.pi * xs) * np.sin(np.pi * ys)
+    image = base * shade[..., None] + rng.normal(0, 6, (height, width, 3)).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def build_cases(processor, image_paths: List[str], resolutions: List[int], synthetic: int) -> List[Dict]:
+    """Benchmark inputs: each image at each resolution, with landmarks when a face is known
+
+    Sample images are detected once at native size and their landmarks
+    scaled with the image. Synthetic images borrow the first detected face,
+    scaled to their size, so effects can be timed without a real face.
+    """
+    cases = []
+    template = None  # normalized landmarks of the first detected face
+
+    for path in image_paths:
+        image = load_image(path)
+        if image is None:
+            continue
+        landmark_data = processor._infer_landmarks(image)
+        landmarks = landmark_data['landmarks'] if landmark_data else None
+        height, width = image.shape[:2]
+        if landmarks is not None and template is None:
+            template = landmarks / np.array([width, height, 1], dtype=np.float32)
+
+        for resolution in resolutions:
+            resized = resize_to(image, resolution)
+            scaled = None
+            if landmarks is not None:
+                scale = resized.shape[1] / width
+                scaled = landmarks * np.array([scale, scale, 1], dtype=np.float32)
+            cases.append({'image': os.path.relpath(path, REPO_ROOT), 'resolution': resolution,
+                          'pixels': resized, 'landmarks': scaled, 'real_face': scaled is not None})
+
+    for index in range(synthetic):
+        for resolution in resolutions:
+            height, width = (resolution * 9) // 16, resolution
+            landmarks = None
+            if template is not None:
+                landmarks = template * np.array([width, height, 1], dtype=np.float32)
+            cases.append({'image': f'synthetic-{index}', 'resolution': resolution,
+                          'pixels': synthetic_image(width, height, index), 'landmarks': landmarks,
+                          'real_face': False})
+
+    return cases
+
+
+def effect_methods(processor) -> Dict[str, Callable]:
+    """Every _apply_*/_enhance_* effect, keyed by stage name (e.g. 'apply_lipstick')"""
+    methods = {}
+    for name in sorted(dir(processor)):
+        if not (name.startswith('_apply_') or name.startswith('_enhance_')):
+            continue
+        method = getattr(processor, name)
+        parameters = inspect.signature(method).parameters
+        if callable(method) and 'image' in parameters and 'landmarks' in parameters:
+            methods[name[1:]] = method
+    return methods
+
+
+def benchmark_stages(module, cases: List[Dict], repeat: int = 5,
+                     stage_filter: Optional[List[str]] = None) -> List[Dict]:
+    """Time every stage on every case it applies to"""
+    processor = module.MediaPipeFaceProcessor()
+    effects = effect_methods(processor)
+
+    def wanted(stage: str) -> bool:
+        return not stage_filter or any(part in stage for part in stage_filter)
+
+    def clear_cache():
+        processor.landmark_cache.clear_memory()
+
+    rows = []
+
+    def record(stage: str, case: Dict, fn: Callable, setup: Optional[Callable] = None) -> None:
+        if not wanted(stage):
+            return
+        row = {'stage': stage, 'image': case['image'], 'resolution': case['resolution'],
+               'size': [case['pixels'].shape[1], case['pixels'].shape[0]]}
+        try:
+            row.update(measure(fn, repeat, setup))
+        except Exception as e:
+            print(f"Error benchmarking {stage} on {case['image']}: {str(e)}", file=sys.stderr)
+            row['error'] = str(e)
+        rows.append(row)
+        print(f"{stage:>18} {case['image'][-40:]:>40} {case['resolution']:>5}px "
+              f"p50 {row.get('p50_ms', 0):9.2f} ms", file=sys.stderr)
+
+    for case in cases:
+        pixels = case['pixels']
+        encoded = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+        # Detection on encoded bytes (decode included), with a cold cache every call
+        record('detect', case, lambda _: processor.detect_face_landmarks_from_buffer(encoded), clear_cache)
+
+        landmarks = case['landmarks']
+        if landmarks is not None:
+            for stage, method in effects.items():
+                parameters = inspect.signature(method).parameters
+                kwargs = {}
+                if 'config' in parameters:
+                    kwargs['config'] = DEFAULT_MAKEUP_CONFIG.get(stage.split('_', 1)[1], {})
+                record(stage, case,
+                       lambda image, method=method, kwargs=kwargs: method(image, landmarks, **kwargs),
+                       pixels.copy)
+
+        if case['real_face']:
+            # End-to-end actions: decode, detect (cold), render and encode
+            record('makeup', case,
+                   lambda _: module.run_action(processor, 'makeup', encoded, DEFAULT_MAKEUP_CONFIG), clear_cache)
+            record('enhance', case,
+                   lambda _: module.run_action(processor, 'enhance', encoded, DEFAULT_ENHANCE_CONFIG), clear_cache)
+
+    return rows
+
+
+def benchmark_inference(module, image_paths: List[str], resolutions: List[int],
+                        repeat: int = 5, upscale: float = 1.0) -> List[Dict]:
+    """Latency and landmark error per working resolution, relative to the full-frame path"""
+    processors = {None: module.MediaPipeFaceProcessor()}
+    for resolution in resolutions:
+        processors[resolution] = module.MediaPipeFaceProcessor(working_resolution=resolution)
+
+    rows = []
+    for path in image_paths:
+        image = load_image(path, upscale)
+        if image is None:
+            continue
+
+        reference = processors[None]._infer_landmarks(image)
+        if reference is None:
+            print(f"No face in {path}; skipping", file=sys.stderr)
+            continue
+        reference_points = reference['landmarks'][:, :2]
+        eye_distance = float(np.linalg.norm(
+            reference_points[RIGHT_EYE_CORNER] - reference_points[LEFT_EYE_CORNER]))
+
+        for resolution, processor in processors.items():
+            # Warm-up run also provides the landmarks we score
+            landmark_data = processor._infer_landmarks(image)
+            row = {
+                'image': os.path.basename(path),
+                'size': [image.shape[1], image.shape[0]],
+                'working_resolution': resolution or 'full',
+                # Whether this frame actually takes the detect-then-crop path
+                'gated': bool(resolution) and max(image.shape[:2]) >= (
+                    resolution * module.MediaPipeFaceProcessor.GATED_MIN_SCALE),
+                'detected': landmark_data is not None
+            }
+            row.update(summarize(time_call(lambda: processor._infer_landmarks(image), repeat)))
+
+            if landmark_data is not None:
+                errors = np.linalg.norm(landmark_data['landmarks'][:, :2] - reference_points, axis=1)
+                row['mean_error_px'] = round(float(errors.mean()), 3)
+                row['max_error_px'] = round(float(errors.max()), 3)
+                row['mean_error_eye_ratio'] = round(float(errors.mean()) / eye_distance, 5)
+            rows.append(row)
+
+    return rows
+
+
+def benchmark_startup(image_path: str, repeat: int = 5) -> List[Dict]:
+    """Wall time of `--action landmarks` in a fresh interpreter, with the median of each start-up step
+
+    request_ms is the request itself, without the model loading it triggered.
+    """
+    command = [sys.executable, PROCESSOR_PATH, '--action', 'landmarks', '--image', image_path,
+               '--landmark-format', 'compact', '--timings']
+    walls, steps = [], {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+            print(f"Cold start failed on {image_path}: {completed.stdout.strip()}", file=sys.stderr)
+            return []
+        timings = json.loads(completed.stdout)['timings']
+        # The request's model_load stage is the import and graph init already in 'startup'
+        request_ms = timings['total_ms'] - timings['stages'].get('model_load', 0.0)
+        for step, ms in dict(timings['startup'], request_ms=request_ms).items():
+            steps.setdefault(step, []).append(ms)
+
+    row = {'stage': 'cold_start_landmarks', 'image': os.path.basename(image_path), 'resolution': None}
+    row.update(summarize(walls))
+    row['steps_p50_ms'] = {step: round(float(np.percentile(ms, 50)), 3) for step, ms in steps.items()}
+    return [row]
+
+
+def benchmark_tracking(module, image_path: str, frames: int = 200, speed=(1.4, 0.3),
+                       fps: float = 30.0) -> List[Dict]:
+    """Pan a detected face at a steady sub-pixel speed through TemporalLandmarkTracker
+
+    Every frame, each region mask the tracker hands out (reused, warped or
+    rebuilt) is compared with one built from scratch for the landmarks it
+    returned; 'drift' is set when a bounding box ends up more than
+    MAX_MASK_DRIFT_PX away.
+    """
+    processor = module.MediaPipeFaceProcessor()
+    image = load_image(image_path)
+    landmark_data = processor._infer_landmarks(image) if image is not None else None
+    if landmark_data is None:
+        print(f"No face in {image_path}; skipping", file=sys.stderr)
+        return []
+
+    # Room for the whole pan, so masks never leave the frame
+    height, width = image.shape[:2]
+    shape = (height + int(abs(speed[1]) * frames) + 1, width + int(abs(speed[0]) * frames) + 1, 3)
+    tracker = module.TemporalLandmarkTracker(processor.region_indices, antialias=processor.antialias_masks)
+    step = np.array([speed[0], speed[1], 0.0], dtype=np.float32)
+
+    timings, max_drift = [], 0.0
+    for frame in range(frames):
+        landmarks = landmark_data['landmarks'] + step * frame
+        start = time.perf_counter()
+        current, masks, _ = tracker.update(0, landmarks, frame / fps, shape)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        fresh = module.RegionMasks(shape, current, processor.region_indices, processor.antialias_masks)
+        for region in processor.region_indices:
+            mask, expected = masks.get(region), fresh.get(region)
+            if mask is None or expected is None:
+                continue
+            drift = max(abs(mask.x0 - expected.x0), abs(mask.y0 - expected.y0),
+                        abs(mask.x1 - expected.x1), abs(mask.y1 - expected.y1))
+            max_drift = max(max_drift, drift)
+
+    row = {'stage': 'tracking', 'image': os.path.basename(image_path), 'resolution': None}
+    row.update(summarize(timings))
+    row.update(tracker.stats(), max_drift_px=max_drift, drift=max_drift > MAX_MASK_DRIFT_PX)
+    return [row]
+
+
+def environment() -> Dict:
+    """Library versions and machine facts stored alongside results"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'mediapipe': getattr(mp, '__version__', 'unknown'),
+        'timestamp': int(time.time())
+    }
+
+
+def suite_rows(report: Dict, suite: str) -> List[Dict]:
+    """The result rows of a report (or baseline) for suite"""
+    return report.get('inference' if suite == 'inference' else 'results', [])
+
+
+def baseline_suite(baseline: Dict) -> str:
+    """Suite a baseline was recorded with (older files did not store it)"""
+    if 'suite' in baseline:
+        return baseline['suite']
+    if 'inference' in baseline:
+        return 'inference'
+    stages = {row.get('stage') for row in baseline.get('results', [])}
+    for suite, stage in (('startup', 'cold_start_landmarks'), ('tracking', 'tracking')):
+        if stages == {stage}:
+            return suite
+    return 'stages'
+
+
+def compare_to_baseline(rows: List[Dict], baseline: Dict, suite: str = 'stages',
+                        threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> Dict:
+    """Match rows to the baseline's rows for the same suite and flag slowdowns
+
+    Rows are matched by (stage, image, resolution); inference rows by
+    (image, working_resolution).
+    """
+    def key(row: Dict):
+        if suite == 'inference':
+            return 'inference', row.get('image'), row.get('working_resolution')
+        return row.get('stage'), row.get('image'), row.get('resolution')
+
+    previous = {key(row): row for row in suite_rows(baseline, suite) if 'p50_ms' in row}
+    comparisons = []
+    for row in rows:
+        before = previous.get(key(row))
+        if before is None or 'p50_ms' not in row or not before['p50_ms']:
+            continue
+        ratio = row['p50_ms'] / before['p50_ms']
+        stage, image, resolution = key(row)
+        comparisons.append({
+            'stage': stage, 'image': image, 'resolution': resolution,
+            'baseline_p50_ms': before['p50_ms'], 'p50_ms': row['p50_ms'], 'ratio': round(ratio, 3),
+            'regression': ratio > threshold
+        })
+
+    return {
+        'threshold': threshold,
+        'compared': len(comparisons),
+        'regressions': [item for item in comparisons if item['regression']],
+        'improvements': [item for item in comparisons if item['ratio'] < 1 / threshold],
+        'stages': comparisons
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MediaPipe Face Processor Benchmarks')
+    parser.add_argument('--suite', default='stages', choices=['stages', 'inference', 'startup', 'tracking'],
+                        help='Per-stage benchmarks, the working-resolution inference sweep, the cold '
+                             'start of the landmarks action, or video mask drift (the last two on the first image)')
+    parser.add_argument('--images', nargs='+', help='Images to benchmark on (default: attached_assets/)')
+    parser.add_argument('--resolutions', type=int, nargs='+',
+                        help='Longest sides to resize images to (stages) or working resolutions (inference)')
+    parser.add_argument('--synthetic', type=int, default=1, help='Number of synthetic images (stages suite)')
+    parser.add_argument('--stages', nargs='+', help='Only run stages whose name contains one of these')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement')
+    parser.add_argument('--upscale', type=float, default=1.0,
+                        help='Enlarge inputs by this factor to simulate high-resolution photos (inference suite)')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='Compare against results saved by an earlier run')
+    parser.add_argument('--save-baseline', help='Also store these results as a baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help='p50 slowdown factor that counts as a regression')
+
+    args = parser.parse_args()
+
+    # Check the baseline before spending minutes on the benchmarks
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline_suite(baseline) != args.suite:
+            parser.error(f"--baseline was recorded with --suite {baseline_suite(baseline)}, not {args.suite}")
+
+    module = load_processor_module()
+    image_paths = args.images or default_image_paths()
+
+    if args.suite == 'inference':
+        rows = benchmark_inference(module, image_paths, args.resolutions or [1280, 960, 640, 480],
+                                   args.repeat, args.upscale)
+        report = {'suite': args.suite, 'environment': environment(), 'inference': rows}
+    elif args.suite == 'startup':
+        rows = benchmark_startup(image_paths[0], args.repeat)
+        report = {'suite': args.suite, 'environment': environment(), 'results': rows}
+    elif args.suite == 'tracking':
+        rows = benchmark_tracking(module, image_paths[0])
+        report = {'suite': args.suite, 'environment': environment(), 'results': rows}
+    else:
+        cases = build_cases(module.MediaPipeFaceProcessor(), image_paths,
+                            args.resolutions or [640, 1280, 1920], args.synthetic)
+        rows = benchmark_stages(module, cases, args.repeat, args.stages)
+        report = {'suite': args.suite, 'environment': environment(), 'results': rows}
+
+    if baseline is not None:
+        report['comparison'] = compare_to_baseline(rows, baseline, args.suite, args.threshold)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({key: value for key, value in report.items() if key != 'comparison'}, f, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    # Non-zero exit lets CI fail on regressions (and on drifting video masks)
+    if report.get('comparison', {}).get('regressions') or any(row.get('drift') for row in rows):
+        sys.exit(1)
+    # ...and on a baseline that matched nothing, which would otherwise pass silently
+    if baseline is not None and rows and not report['comparison']['compared']:
+        print("No results matched the baseline (different images or resolutions?)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,38 +5,860 @@ Professional facial landmark detection and makeup application using Google's Med
 Support for 468 facial landmarks with real-time processing capabilities
 """
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import cv2
-import mediapipe as mp
 import numpy as np
-from PIL import Image
 import json
 import sys
 import os
-import time
 import argparse
-from typing import List, Tuple, Dict, Optional
+import base64
+import hashlib
+import queue
+import shutil
+import struct
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+# asyncio, multiprocessing, socketserver and concurrent.futures are imported
+# where the server, pool and bulk paths need them: a one-off CLI run skips them
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+# mediapipe takes most of a cold start to import, so it is loaded on first use
+_mediapipe = None
+_mediapipe_lock = threading.Lock()
+
+# Milliseconds spent in each start-up step of this process (first occurrence wins)
+_startup_timings = {'module_import_ms': round((time.perf_counter() - _IMPORT_STARTED) * 1000, 3)}
+
+
+def _record_startup(name: str, started: float) -> None:
+    """Keep how long a start-up step took, unless an earlier one already claimed the name"""
+    _startup_timings.setdefault(name, round((time.perf_counter() - started) * 1000, 3))
+
+
+def startup_timings() -> Dict[str, float]:
+    """Start-up steps taken so far: module import, mediapipe import, graph construction, warm-up"""
+    return dict(_startup_timings)
+
+
+def load_mediapipe():
+    """The mediapipe package, imported on the first call"""
+    global _mediapipe
+    if _mediapipe is None:
+        with _mediapipe_lock:
+            if _mediapipe is None:
+                started = time.perf_counter()
+                import mediapipe
+                _record_startup('mediapipe_import_ms', started)
+                _mediapipe = mediapipe
+    return _mediapipe
+
+
+class RequestTimings:
+    """Per-request stage timings and counters, collected on the current thread
+
+    Enter it around a request; timed_stage() and count_event() calls made on
+    the same thread while it is active are recorded, and are no-ops
+    otherwise. Stage times are exclusive: a stage nested in another (a mask
+    built while blending) is not also counted in its parent.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, profiler: Optional['SamplingProfiler'] = None):
+        self.stages = {}  # stage -> exclusive milliseconds
+        self.counters = {}
+        self.profiler = profiler
+        self.total_ms = 0.0
+        self._open = []  # child milliseconds of each currently open stage
+
+    def __enter__(self) -> 'RequestTimings':
+        self._previous = getattr(self._local, 'timings', None)
+        self._local.timings = self
+        if self.profiler:
+            self.profiler.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+        if self.profiler:
+            self.profiler.stop()
+        self._local.timings = self._previous
+        return False
+
+    @classmethod
+    def current(cls) -> Optional['RequestTimings']:
+        return getattr(cls._local, 'timings', None)
+
+    @contextmanager
+    def attached(self):
+        """Make this the active request on the current thread, for stages handed to other threads"""
+        previous = getattr(self._local, 'timings', None)
+        self._local.timings = self
+        try:
+            yield self
+        finally:
+            self._local.timings = previous
+
+    def add(self, name: str, ms: float) -> None:
+        """Add milliseconds measured elsewhere to a stage"""
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    @contextmanager
+    def stage(self, name: str):
+        self._open.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            children = self._open.pop()
+            self.add(name, elapsed - children)
+            if self._open:
+                self._open[-1] += elapsed
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self) -> Dict:
+        timings = {
+            'total_ms': round(self.total_ms, 3),
+            'stages': {name: round(ms, 3) for name, ms in self.stages.items()},
+            'counters': dict(self.counters)
+        }
+        if self.profiler:
+            timings['profile'] = self.profiler.as_dict()
+        return timings
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Time a block as stage name of the active request, if any"""
+    timings = RequestTimings.current()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+
+def count_event(name: str, amount: int = 1) -> None:
+    """Bump a counter of the active request, if any"""
+    timings = RequestTimings.current()
+    if timings is not None:
+        timings.count(name, amount)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval
+
+    Stacks are collapsed outermost-first into 'a;b;c' strings (the format
+    flame graph tools read); as_dict() reports the most frequent ones.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 40, top: int = 20):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.top = top
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.samples[self._collapse(frame)] += 1
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def as_dict(self) -> Dict:
+        return {
+            'interval_ms': self.interval * 1000,
+            'samples': sum(self.samples.values()),
+            'stacks': [{'stack': stack, 'count': count} for stack, count in self.samples.most_common(self.top)]
+        }
+
+
+class LandmarkCache:
+    """Content-addressed landmark cache: in-memory LRU tier plus optional on-disk tier
+
+    Entries are keyed by a hash of the raw image bytes and the FaceMesh
+    settings, so identical uploads skip inference whatever their file name.
+    Both tiers evict least recently used entries once over their byte budget.
+    """
+
+    # Bump when the cached landmark layout or values change
+    FORMAT_VERSION = 3
+
+    def __init__(self, max_memory_bytes: int = 32 * 1024 * 1024,
+                 disk_dir: Optional[str] = None, max_disk_bytes: int = 256 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()  # key -> (value, size)
+        self._memory_bytes = 0
+        self._disk_bytes = None  # measured lazily on first write
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def make_key(self, image_bytes, settings: Dict) -> str:
+        """Hash image bytes (any C-contiguous buffer) together with the settings that shape the result"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.FORMAT_VERSION, settings], sort_keys=True).encode('utf-8'))
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Look a key up in memory, then on disk (promoting disk hits to memory)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[0]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+
+        self._put_memory(key, value, self._entry_size(value))
+        return value
+
+    def put(self, key: str, value: Dict) -> None:
+        """Store a landmark result (arrays are made read-only, since hits share them)"""
+        self._freeze(value)
+        self._put_memory(key, value, self._entry_size(value))
+        if self.disk_dir:
+            self._write_disk(key, json.dumps(self._to_json(value)))
+
+    def clear_memory(self) -> None:
+        """Drop every in-memory entry (the disk tier is left alone)"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes or 0
+            }
+
+    @classmethod
+    def _to_json(cls, value):
+        """Make arrays JSON-safe (exact base64 of their bytes) for the disk tier"""
+        if isinstance(value, np.ndarray):
+            return {'__ndarray__': base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii'),
+                    'dtype': str(value.dtype), 'shape': list(value.shape)}
+        if isinstance(value, dict):
+            return {k: cls._to_json(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._to_json(v) for v in value]
+        return value
+
+    @classmethod
+    def _from_json(cls, value):
+        if isinstance(value, dict):
+            if '__ndarray__' in value:
+                data = base64.b64decode(value['__ndarray__'])
+                return np.frombuffer(data, dtype=value['dtype']).reshape(value['shape']).copy()
+            return {k: cls._from_json(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._from_json(v) for v in value]
+        return value
+
+    @classmethod
+    def _freeze(cls, value) -> None:
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        elif isinstance(value, dict):
+            for v in value.values():
+                cls._freeze(v)
+        elif isinstance(value, list):
+            for v in value:
+                cls._freeze(v)
+
+    @classmethod
+    def _entry_size(cls, value) -> int:
+        """Approximate memory footprint: array bytes plus a flat cost per other object"""
+        if isinstance(value, np.ndarray):
+            return value.nbytes + 112
+        if isinstance(value, dict):
+            return 64 + sum(cls._entry_size(v) for v in value.values())
+        if isinstance(value, list):
+            return 56 + sum(cls._entry_size(v) for v in value)
+        return 32
+
+    def _put_memory(self, key: str, value: Dict, size: int) -> None:
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                value = self._from_json(json.load(f))
+            self._freeze(value)
+            # Touch the entry so disk eviction stays least-recently-used
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, encoded: str) -> None:
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so concurrent workers never see partial files
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing landmark cache: {str(e)}", file=sys.stderr)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._scan_disk())
+            else:
+                self._disk_bytes += len(encoded)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _scan_disk(self) -> List[Tuple[float, str, int]]:
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def _evict_disk(self) -> None:
+        """Delete the oldest files until the disk tier is back under 90% of budget"""
+        entries = sorted(self._scan_disk())
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * 0.9
+        evicted = 0
+
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._disk_bytes = total
+            self.evictions += evicted
+
+
+def region_points(landmarks: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """(N, 2) sub-pixel coordinates of the given landmark indices, in one fancy-index"""
+    if len(indices) and indices.max() >= len(landmarks):
+        indices = indices[indices < len(landmarks)]
+    return landmarks[indices, :2]
+
+
+def landmark_bbox(landmarks: np.ndarray) -> Dict:
+    """Pixel bounding box {'x', 'y', 'width', 'height'} of a face's landmarks"""
+    xy = landmarks[:, :2].astype(np.int64)
+    x0, y0 = xy.min(axis=0).tolist()
+    x1, y1 = xy.max(axis=0).tolist()
+    return {'x': x0, 'y': y0, 'width': x1 - x0, 'height': y1 - y0}
+
+
+def landmarks_to_json(landmarks: np.ndarray) -> List[Dict]:
+    """Legacy [{'x', 'y', 'z'}] form with integer pixel x/y, as the CLI has always printed it"""
+    xy = landmarks[:, :2].astype(np.int64).tolist()
+    return [{'x': x, 'y': y, 'z': z} for (x, y), z in zip(xy, landmarks[:, 2].tolist())]
+
+
+def landmark_data_to_json(landmark_data: Dict) -> Dict:
+    """JSON-ready copy of a detection result, with every landmark array in legacy form"""
+    return _map_landmarks(landmark_data, landmarks_to_json)
+
+
+# Landmark output formats: 'json' is the legacy list of {'x', 'y', 'z'}
+# dicts, 'compact' uses [x, y, z] rows, and 'binary' is packed by
+# pack_landmark_response() into LANDMARK_MAGIC + header + float32 block.
+LANDMARK_FORMATS = ('json', 'compact', 'binary')
+LANDMARK_MAGIC = b'MPLM'
+LANDMARK_HEADER = struct.Struct('<4sHI')  # magic, version, metadata length
+LANDMARK_BINARY_VERSION = 1
+
+
+def format_landmark_data(landmark_data: Dict, landmark_format: str = 'json',
+                         indices: Optional[np.ndarray] = None) -> Dict:
+    """Shape a detection result for output, optionally keeping only some landmark indices
+
+    With a subset, 'indices' lists the original landmark index of each row
+    and 'total_points' counts the rows returned. 'binary' keeps the float32
+    arrays for pack_landmark_response().
+    """
+    if landmark_format not in LANDMARK_FORMATS:
+        raise ValueError(f"Unsupported landmark format: {landmark_format}")
+
+    if indices is not None:
+        landmark_data = _map_landmarks(landmark_data, lambda landmarks: landmarks[indices])
+        landmark_data['indices'] = indices.tolist()
+        landmark_data['total_points'] = len(indices)
+
+    if landmark_format == 'json':
+        return landmark_data_to_json(landmark_data)
+    if landmark_format == 'compact':
+        return _map_landmarks(landmark_data, _landmarks_to_rows)
+    return dict(landmark_data)
+
+
+def pack_landmark_response(response: Dict) -> bytes:
+    """Pack a 'binary' landmark response
+
+    Layout (little-endian): LANDMARK_HEADER, then the compact JSON metadata
+    (every non-array field plus 'shape'), then a float32 block of that shape,
+    (faces, points, 3), holding sub-pixel x, y and depth z.
+    """
+    faces = response.get('faces')
+    if faces:
+        block = np.stack([face['landmarks'] for face in faces])
+    else:
+        block = response['landmarks'][np.newaxis]
+
+    meta = {key: value for key, value in response.items() if key != 'landmarks'}
+    if faces:
+        meta['faces'] = [{k: v for k, v in face.items() if k != 'landmarks'} for face in faces]
+    meta['shape'] = list(block.shape)
+
+    encoded_meta = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    header = LANDMARK_HEADER.pack(LANDMARK_MAGIC, LANDMARK_BINARY_VERSION, len(encoded_meta))
+    return header + encoded_meta + block.astype('<f4', copy=False).tobytes()
+
+
+def unpack_landmark_response(payload: bytes) -> Dict:
+    """Inverse of pack_landmark_response(): metadata with float32 (points, 3) landmark arrays"""
+    magic, version, meta_size = LANDMARK_HEADER.unpack_from(payload)
+    if magic != LANDMARK_MAGIC:
+        raise ValueError("Not a packed landmark response")
+    if version != LANDMARK_BINARY_VERSION:
+        raise ValueError(f"Unsupported landmark binary version: {version}")
+
+    offset = LANDMARK_HEADER.size
+    response = json.loads(payload[offset:offset + meta_size].decode('utf-8'))
+    block = np.frombuffer(payload, dtype='<f4', offset=offset + meta_size).reshape(response.pop('shape'))
+
+    # Top-level landmarks are those of the first face, as in the detection result
+    response['landmarks'] = block[0]
+    if 'faces' in response:
+        response['faces'] = [dict(face, landmarks=landmarks)
+                             for face, landmarks in zip(response['faces'], block)]
+    return response
+
+
+def encode_response(response: Dict) -> bytes:
+    """Wire bytes for a response: packed binary for binary landmarks, compact JSON otherwise"""
+    if isinstance(response.get('landmarks'), np.ndarray):
+        return pack_landmark_response(response)
+    return json.dumps(response, separators=(',', ':')).encode('utf-8')
+
+
+def _landmarks_to_rows(landmarks: np.ndarray) -> List[List]:
+    xy = landmarks[:, :2].astype(np.int64).tolist()
+    return [[x, y, z] for (x, y), z in zip(xy, landmarks[:, 2].tolist())]
+
+
+def _map_landmarks(landmark_data: Dict, convert) -> Dict:
+    """Copy of a detection result with convert() applied to every landmark array"""
+    data = dict(landmark_data, landmarks=convert(landmark_data['landmarks']))
+    if 'faces' in data:
+        data['faces'] = [dict(face, landmarks=convert(face['landmarks'])) for face in data['faces']]
+    return data
+
+
+class RegionMask:
+    """A filled landmark polygon rasterized only inside its bounding box
+
+    Hard masks truncate landmarks to whole pixels (mask is 0/255); soft
+    masks keep sub-pixel precision and antialias the polygon edge, so the
+    mask doubles as a per-pixel alpha.
+    """
+
+    __slots__ = ('mask', 'soft', 'x0', 'y0', 'x1', 'y1')
+
+    # Fractional bits used when rasterizing sub-pixel polygons
+    SUBPIXEL_SHIFT = 4
+
+    def __init__(self, points: np.ndarray, image_shape: Tuple[int, ...], padding: int = 0,
+                 soft: bool = False):
+        height, width = image_shape[:2]
+        self.soft = soft
+        if soft:
+            low, high = np.floor(points.min(axis=0)), np.ceil(points.max(axis=0))
+        else:
+            points = points.astype(np.int32)
+            low, high = points.min(axis=0), points.max(axis=0)
+
+        # Bounding box in pixel space, padded for filters that read neighbours
+        self.x0 = max(int(low[0]) - padding, 0)
+        self.y0 = max(int(low[1]) - padding, 0)
+        self.x1 = min(int(high[0]) + 1 + padding, width)
+        self.y1 = min(int(high[1]) + 1 + padding, height)
+
+        self.mask = np.zeros((max(self.y1 - self.y0, 0), max(self.x1 - self.x0, 0)), dtype=np.uint8)
+        if not self.mask.size:
+            return
+
+        if soft:
+            scale = 1 << self.SUBPIXEL_SHIFT
+            fixed = np.rint((points - (self.x0, self.y0)) * scale).astype(np.int32)
+            cv2.fillPoly(self.mask, [fixed], 255, cv2.LINE_AA, self.SUBPIXEL_SHIFT)
+        else:
+            cv2.fillPoly(self.mask, [points - np.array([self.x0, self.y0], dtype=np.int32)], 255)
+
+    @property
+    def roi(self) -> Tuple[slice, slice]:
+        """Slices selecting the mask's bounding box in the full image"""
+        return slice(self.y0, self.y1), slice(self.x0, self.x1)
+
+    @property
+    def empty(self) -> bool:
+        return self.mask.size == 0
+
+    def translated(self, dx: int, dy: int, image_shape: Tuple[int, ...]) -> Optional['RegionMask']:
+        """Same mask shifted by whole pixels, or None if it would leave the image"""
+        height, width = image_shape[:2]
+        if self.x0 + dx < 0 or self.y0 + dy < 0 or self.x1 + dx > width or self.y1 + dy > height:
+            return None
+
+        shifted = RegionMask.__new__(RegionMask)
+        shifted.mask = self.mask
+        shifted.soft = self.soft
+        shifted.x0, shifted.x1 = self.x0 + dx, self.x1 + dx
+        shifted.y0, shifted.y1 = self.y0 + dy, self.y1 + dy
+        return shifted
+
+
+class RegionMasks:
+    """Lazily built, memoized RegionMask per makeup region for one landmark set
+
+    Build one per (image, landmarks) and share it across effects and
+    variants; each polygon is rasterized at most once. regions maps region
+    names to landmark index arrays.
+    """
+
+    def __init__(self, image_shape: Tuple[int, ...], landmarks: np.ndarray, regions: Dict[str, np.ndarray],
+                 antialias: bool = False):
+        self.image_shape = image_shape
+        self.landmarks = landmarks
+        self.regions = regions
+        self.antialias = antialias
+        self._masks = {}
+
+    def get(self, region: str, min_points: int = 3, padding: int = 0) -> Optional[RegionMask]:
+        """Mask for a region, or None if too few of its landmarks are present"""
+        key = (region, padding)
+        if key not in self._masks:
+            points = region_points(self.landmarks, self.regions[region])
+            mask = None
+            if len(points) >= min_points:
+                with timed_stage('mask_build'):
+                    mask = RegionMask(points, self.image_shape, padding, self.antialias)
+                if mask.empty:
+                    mask = None
+            self._masks[key] = mask
+        return self._masks[key]
+
+    def translated(self, dx: int, dy: int, landmarks: np.ndarray) -> 'RegionMasks':
+        """Masks for a rigidly shifted face: built masks move, missing ones rebuild lazily"""
+        shifted = RegionMasks(self.image_shape, landmarks, self.regions, self.antialias)
+        for key, mask in self._masks.items():
+            if mask is not None:
+                moved = mask.translated(dx, dy, self.image_shape)
+                if moved is not None:
+                    shifted._masks[key] = moved
+        return shifted
+
+
+class MakeupLayer:
+    """One compositing step of a makeup plan
+
+    kind is 'color' (flat color through a region mask), 'spot' (blurred
+    circle at a region's centre), 'stroke' (polyline along a region's first
+    half) or 'smooth' (bilateral filter blended through a region mask).
+    """
+
+    __slots__ = ('effect', 'kind', 'region', 'color_bgr', 'intensity', 'size', 'min_points', 'padding')
+
+    def __init__(self, effect: str, kind: str, region: str, color_bgr: Optional[Tuple[int, int, int]] = None,
+                 intensity: float = 0.0, size: int = 0, min_points: int = 3, padding: int = 0):
+        self.effect = effect
+        self.kind = kind
+        self.region = region
+        self.color_bgr = color_bgr
+        self.intensity = intensity
+        self.size = size  # blush radius or eyeliner thickness
+        self.min_points = min_points
+        self.padding = padding
+
+
+class MakeupPlan:
+    """A makeup_config compiled to an ordered, immutable list of region layers"""
+
+    __slots__ = ('layers', 'effects')
+
+    def __init__(self, layers: List[MakeupLayer], effects: List[str]):
+        self.layers = tuple(layers)
+        self.effects = tuple(effects)
+
+
+class OneEuroFilter:
+    """One-Euro low-pass filter applied element-wise to a landmark array
+
+    Slow movements are smoothed hard (min_cutoff, in Hz) to remove jitter;
+    the cutoff rises with speed (beta) so fast head motion is not lagged.
+    """
+
+    def __init__(self, min_cutoff: float = 1.0, beta: float = 0.05, d_cutoff: float = 1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self._x = None
+        self._dx = None
+        self._t = None
+
+    def __call__(self, x: np.ndarray, t: float) -> np.ndarray:
+        if self._x is None or self._x.shape != x.shape:
+            self._x = x.astype(np.float32)
+            self._dx = np.zeros_like(self._x)
+            self._t = t
+            return self._x
+
+        dt = max(t - self._t, 1e-6)
+        self._t = t
+
+        # Smoothed speed drives the adaptive cutoff
+        speed = (x - self._x) / dt
+        self._dx += self._alpha(dt, self.d_cutoff) * (speed - self._dx)
+        cutoff = self.min_cutoff + self.beta * np.abs(self._dx)
+
+        self._x = self._x + self._alpha(dt, cutoff) * (x - self._x)
+        return self._x
+
+    @staticmethod
+    def _alpha(dt: float, cutoff):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+
+class TemporalLandmarkTracker:
+    """Per-face landmark smoothing and region-mask reuse across consecutive frames
+
+    Each face keeps a OneEuroFilter and the landmarks its current masks were
+    built from. When the smoothed landmarks have moved less than
+    reuse_threshold_px the previous masks (and landmarks) are reused as-is;
+    when the motion is a near-rigid shift (residual under warp_threshold_px)
+    the masks are translated; otherwise they are rebuilt.
+    """
+
+    def __init__(self, regions: Dict[str, np.ndarray], reuse_threshold_px: float = 1.0,
+                 warp_threshold_px: float = 1.5, min_cutoff: float = 1.0, beta: float = 0.05,
+                 antialias: bool = False):
+        self.regions = regions
+        self.antialias = antialias
+        self.reuse_threshold_px = reuse_threshold_px
+        self.warp_threshold_px = warp_threshold_px
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self._faces = {}
+        self.counts = {'reused': 0, 'warped': 0, 'rebuilt': 0}
+
+    def update(self, face_id: int, landmarks: np.ndarray, timestamp: float,
+               image_shape: Tuple[int, ...]) -> Tuple[np.ndarray, RegionMasks, str]:
+        """Smooth one face's landmarks; returns (landmarks, masks, 'reused'|'warped'|'rebuilt')"""
+        state = self._faces.get(face_id)
+        if state is None or state['shape'] != image_shape[:2]:
+            state = {'filter': OneEuroFilter(self.min_cutoff, self.beta), 'shape': image_shape[:2],
+                     'reference': None, 'landmarks': None, 'masks': None}
+            self._faces[face_id] = state
+
+        smoothed = state['filter'](landmarks, timestamp)
+        reference = state['reference']
+        action = 'rebuilt'
+
+        if reference is not None and reference.shape == smoothed.shape:
+            displacement = smoothed[:, :2] - reference[:, :2]
+            if np.abs(displacement).max() < self.reuse_threshold_px:
+                action = 'reused'
+            else:
+                shift = np.rint(np.median(displacement, axis=0))
+                if np.abs(displacement - shift).max() < self.warp_threshold_px:
+                    action = 'warped'
+
+        if action == 'reused':
+            self.counts[action] += 1
+            return state['landmarks'], state['masks'], action
+
+        current = smoothed.copy()
+        if action == 'warped':
+            dx, dy = int(shift[0]), int(shift[1])
+            masks = state['masks'].translated(dx, dy, current)
+            # The masks moved by whole pixels; measure the next frame against where
+            # they now are, or each warp's rounding error carries into the next
+            reference = reference.copy()
+            reference[:, :2] += shift
+        else:
+            masks = RegionMasks(image_shape, current, self.regions, self.antialias)
+            reference = current
+
+        state.update(reference=reference, landmarks=current, masks=masks)
+        self.counts[action] += 1
+        return current, masks, action
+
+    def forget(self, face_id: int) -> None:
+        """Drop a face's state, e.g. when it is lost"""
+        self._faces.pop(face_id, None)
+
+    def retain(self, face_ids) -> None:
+        """Drop the state of every face not in face_ids"""
+        keep = set(face_ids)
+        for face_id in [face_id for face_id in self._faces if face_id not in keep]:
+            del self._faces[face_id]
+
+    def stats(self) -> Dict:
+        """How often masks were reused, warped or rebuilt"""
+        total = sum(self.counts.values())
+        reused = self.counts['reused'] + self.counts['warped']
+        return dict(self.counts, frames=total, reuse_rate=reused / total if total else 0.0)
+
 
 class MediaPipeFaceProcessor:
-    def __init__(self):
-        """Initialize MediaPipe Face Mesh and Face Detection"""
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.mp_face_detection = mp.solutions.face_detection
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.mp_drawing_styles = mp.solutions.drawing_styles
-        
-        # Initialize face mesh with high accuracy
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.7,
-            min_tracking_confidence=0.7
-        )
-        
-        # Initialize face detection
-        self.face_detection = self.mp_face_detection.FaceDetection(
-            model_selection=1,  # Full range model for better accuracy
-            min_detection_confidence=0.7
+    # Foundation's bilateral filter footprint; its ROI is padded by half of it
+    FOUNDATION_FILTER_DIAMETER = 15
+    # Blush softening kernel; it bounds how far a cheek's blush can spread
+    BLUSH_BLUR_SIZE = 31
+
+    # Extra margin around a FaceDetection box (fraction of its size) before meshing the crop
+    FACE_CROP_PADDING = 0.3
+
+    # Longest side face crops are resized down to before meshing in working-resolution
+    # mode; a little above the 192px landmark model input so its ROI warp still downsamples
+    MESH_INPUT_SIZE = 256
+
+    # The detect-then-crop path only pays off on frames at least this many times
+    # the working resolution; closer to it, the extra detection pass costs more
+    # than meshing the whole frame (and adds landmark error)
+    GATED_MIN_SCALE = 3.0
+
+    # Makeup effects in the order _render_makeup applies them
+    MAKEUP_EFFECTS = ('lipstick', 'eyeshadow', 'blush', 'eyeliner', 'foundation')
+
+    # Compiled plans kept for repeated looks (LRU)
+    PLAN_CACHE_SIZE = 128
+
+    # Output encodings: format -> (extension, OpenCV quality flag, default quality)
+    IMAGE_FORMATS = {
+        'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 95),
+        'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 95),
+        'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 90),
+        'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 1)
+    }
+
+    def __init__(self, landmark_cache_dir: Optional[str] = None,
+                 landmark_cache_bytes: int = 32 * 1024 * 1024, max_num_faces: int = 1,
+                 antialias_masks: bool = False, working_resolution: Optional[int] = None):
+        """Configure MediaPipe Face Mesh and Face Detection (both graphs are built on first use)"""
+        # Face mesh settings, tuned for high accuracy
+        self.face_mesh_settings = {
+            'static_image_mode': True,
+            'max_num_faces': max_num_faces,
+            'refine_landmarks': True,
+            'min_detection_confidence': 0.7,
+            'min_tracking_confidence': 0.7
+        }
+        self._face_mesh = None
+        self._face_detection = None
+        self._graph_lock = threading.Lock()
+
+        # Longest side to run face detection at; frames GATED_MIN_SCALE times larger
+        # are never meshed whole, FaceMesh only sees their (resized) face crops
+        self.working_resolution = working_resolution
+
+        # Landmarks are reused across actions on the same pixels
+        self.landmark_cache = LandmarkCache(
+            max_memory_bytes=landmark_cache_bytes,
+            disk_dir=landmark_cache_dir
         )
         
         # Makeup application regions (MediaPipe landmark indices)
@@ -50,270 +872,896 @@ class MediaPipeFaceProcessor:
             'cheeks_left': [116, 117, 118, 119, 120, 121, 126, 142, 36, 205, 206, 207, 213, 192, 147],
             'cheeks_right': [345, 346, 347, 348, 349, 350, 451, 452, 453, 464, 435, 410, 454, 323, 366],
             'forehead': [10, 151, 9, 8, 107, 55, 65, 52, 53, 46, 70, 63, 105, 66, 108, 69, 104, 68, 71, 139],
-            'chin': [175, 199, 200, 17, 18, 175, 199, 200, 17, 18, 175, 199, 200, 17, 18]
+            'chin': [175, 199, 200, 17, 18, 175, 199, 200, 17, 18, 175, 199, 200, 17, 18],
+            'face_outline': [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377, 152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
         }
+
+        # Index arrays so a region's points are one fancy-index into the (N, 3) landmarks
+        self.region_indices = {
+            name: np.array(indices, dtype=np.intp) for name, indices in self.makeup_regions.items()
+        }
+
+        # Sub-pixel, antialiased region masks (soft edges) instead of hard 0/255 ones
+        self.antialias_masks = antialias_masks
+
+        # makeup_config (canonical JSON) -> MakeupPlan; compositing may run on several threads
+        self._plan_cache = OrderedDict()
+        self._plan_lock = threading.Lock()
         
+    @property
+    def mp_face_mesh(self):
+        return load_mediapipe().solutions.face_mesh
+
+    @property
+    def mp_face_detection(self):
+        return load_mediapipe().solutions.face_detection
+
+    @property
+    def face_mesh(self):
+        """FaceMesh graph, built on first use"""
+        if self._face_mesh is None:
+            self._build_graph('face_mesh')
+        return self._face_mesh
+
+    @property
+    def face_detection(self):
+        """FaceDetection graph, built on first use (only the multi-face and working-resolution paths need it)"""
+        if self._face_detection is None:
+            self._build_graph('face_detection')
+        return self._face_detection
+
+    def _build_graph(self, name: str) -> None:
+        """Construct one of the MediaPipe graphs, once, whichever thread asks first
+
+        Within a request the import and construction show up as the
+        'model_load' stage, never as part of 'inference'.
+        """
+        with timed_stage('model_load'):
+            load_mediapipe()  # timed separately from the graph itself
+            with self._graph_lock:
+                if getattr(self, '_' + name) is not None:
+                    return
+                started = time.perf_counter()
+                if name == 'face_mesh':
+                    graph = self.mp_face_mesh.FaceMesh(**self.face_mesh_settings)
+                else:
+                    graph = self.mp_face_detection.FaceDetection(
+                        model_selection=1,  # Full range model for better accuracy
+                        min_detection_confidence=0.7
+                    )
+                setattr(self, '_' + name, graph)
+                _record_startup(f'{name}_init_ms', started)
+
+    def warmup(self) -> Dict[str, float]:
+        """Build the graphs this configuration uses and run each once on a blank frame
+
+        Server modes call this before taking jobs so the first request does not
+        pay for the mediapipe import, graph construction and TFLite set-up.
+        Returns the start-up timings so far.
+        """
+        load_mediapipe()
+        started = time.perf_counter()
+        blank = np.zeros((self.MESH_INPUT_SIZE, self.MESH_INPUT_SIZE, 3), dtype=np.uint8)
+        self.face_mesh.process(blank)
+        if self.face_mesh_settings['max_num_faces'] > 1 or self.working_resolution:
+            self.face_detection.process(blank)
+        _record_startup('warmup_ms', started)
+        return startup_timings()
+
     def detect_face_landmarks(self, image_path: str) -> Optional[Dict]:
         """Detect facial landmarks using MediaPipe Face Mesh (468 points)"""
         try:
-            # Read image
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError(f"Could not load image: {image_path}")
-                
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Process the image
-            results = self.face_mesh.process(rgb_image)
-            
-            if not results.multi_face_landmarks:
-                return None
-                
-            # Get image dimensions
-            height, width = image.shape[:2]
-            
-            # Extract landmarks for the first detected face
-            face_landmarks = results.multi_face_landmarks[0]
-            landmarks = []
-            
-            for landmark in face_landmarks.landmark:
-                x = int(landmark.x * width)
-                y = int(landmark.y * height)
-                z = landmark.z  # Depth information
-                landmarks.append({'x': x, 'y': y, 'z': z})
-            
-            return {
-                'landmarks': landmarks,
-                'total_points': len(landmarks),
-                'image_size': {'width': width, 'height': height},
-                'confidence': 0.95  # MediaPipe typically has high confidence
-            }
+            # Read raw bytes once: they key the cache and are decoded only on a miss
+            image_bytes = self._read_image_bytes(image_path)
+            return self._detect_landmarks(image_bytes, None, image_path)
             
         except Exception as e:
             print(f"Error detecting landmarks: {str(e)}", file=sys.stderr)
             return None
+
+    def detect_face_landmarks_from_buffer(self, data) -> Optional[Dict]:
+        """Detect landmarks in encoded image bytes (JPEG/PNG/WebP) or a decoded BGR numpy array"""
+        try:
+            return self._detect_landmarks(self._as_buffer(data), None, '<buffer>')
+
+        except Exception as e:
+            print(f"Error detecting landmarks: {str(e)}", file=sys.stderr)
+            return None
+
+    def _as_buffer(self, data):
+        """Normalize an in-memory image to bytes or a C-contiguous array"""
+        if isinstance(data, np.ndarray):
+            return np.ascontiguousarray(data)
+        return bytes(data)
+
+    def _read_image_bytes(self, image_path: str) -> bytes:
+        """Read an encoded image from disk"""
+        try:
+            with timed_stage('read'), open(image_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            raise ValueError(f"Could not load image: {image_path}")
+
+    def _decode_image(self, image_bytes: bytes, source: str) -> np.ndarray:
+        """Decode JPEG/PNG bytes into a BGR image"""
+        with timed_stage('decode'):
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not load image: {source}")
+        return image
+
+    def _landmark_cache_key(self, image_bytes) -> Optional[str]:
+        """Cache key of encoded image bytes under the current detection settings
+
+        Decoded arrays get None (no caching): hashing a 4K frame costs more
+        than running inference on it, for a key that rarely repeats.
+        """
+        if isinstance(image_bytes, np.ndarray):
+            return None
+        key_settings = self.face_mesh_settings
+        if self.working_resolution:
+            key_settings = dict(key_settings, working_resolution=self.working_resolution)
+        return self.landmark_cache.make_key(image_bytes, key_settings)
+
+    def _cached_landmarks(self, cache_key: Optional[str]) -> Optional[Dict]:
+        """Landmarks already detected for cache_key, or None"""
+        if cache_key is None:
+            return None
+        cached = self.landmark_cache.get(cache_key)
+        if cached is not None:
+            count_event('landmark_cache_hits')
+            count_event('faces_found', cached.get('num_faces', 1))
+        return cached
+
+    def _detect_landmarks(self, image_bytes, image: Optional[np.ndarray],
+                          source: str, cache_key: Optional[str] = None) -> Optional[Dict]:
+        """Cache-aware landmark detection; decodes image_bytes only if needed
+
+        image_bytes may also be a decoded BGR array, which is used directly
+        and bypasses the cache.
+        """
+        if isinstance(image_bytes, np.ndarray):
+            image = image_bytes
+        else:
+            cache_key = cache_key or self._landmark_cache_key(image_bytes)
+            cached = self._cached_landmarks(cache_key)
+            if cached is not None:
+                return cached
+            count_event('landmark_cache_misses')
+
+        if image is None:
+            image = self._decode_image(image_bytes, source)
+
+        landmark_data = self._infer_landmarks(image)
+        if landmark_data is not None:
+            count_event('faces_found', landmark_data.get('num_faces', 1))
+            if cache_key is not None:
+                self.landmark_cache.put(cache_key, landmark_data)
+        return landmark_data
+
+    def _infer_landmarks(self, image: np.ndarray) -> Optional[Dict]:
+        """Run the detection models on a BGR image (no caching)"""
+        # Get image dimensions
+        height, width = image.shape[:2]
+        multi_face = self.face_mesh_settings['max_num_faces'] > 1
+
+        downscaled = (bool(self.working_resolution) and
+                      max(height, width) >= self.working_resolution * self.GATED_MIN_SCALE)
+
+        if multi_face or downscaled:
+            faces = self._detect_faces_gated(image)
+        else:
+            # Convert BGR to RGB and process the full frame
+            with timed_stage('color_convert'):
+                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            face_mesh = self.face_mesh
+            with timed_stage('inference'):
+                results = face_mesh.process(rgb_image)
+                faces = [self._extract_landmarks(face_landmarks, width, height)
+                         for face_landmarks in results.multi_face_landmarks or []]
+        
+        if not faces:
+            return None
+        
+        # Top-level landmarks stay those of the first face
+        landmarks = faces[0]
+        
+        landmark_data = {
+            'landmarks': landmarks,
+            'total_points': len(landmarks),
+            'image_size': {'width': width, 'height': height},
+            'confidence': 0.95  # MediaPipe typically has high confidence
+        }
+        if multi_face:
+            landmark_data['num_faces'] = len(faces)
+            landmark_data['faces'] = [
+                {'landmarks': face, 'bbox': landmark_bbox(face)} for face in faces
+            ]
+        return landmark_data
+
+    def _extract_landmarks(self, face_landmarks, width: int, height: int,
+                           offset_x: int = 0, offset_y: int = 0, z_scale: float = 1.0) -> np.ndarray:
+        """Convert normalized FaceMesh landmarks to an (N, 3) float32 array of sub-pixel x, y and depth z
+
+        z is normalized like x, so landmarks from a crop pass z_scale = crop
+        width / image width to keep depth relative to the full image.
+        """
+        points = np.array([(lm.x, lm.y, lm.z) for lm in face_landmarks.landmark], dtype=np.float64)
+        points[:, 0] = points[:, 0] * width + offset_x
+        points[:, 1] = points[:, 1] * height + offset_y
+        points[:, 2] *= z_scale
+        return points.astype(np.float32)
+
+    def _region_masks(self, image_shape: Tuple[int, ...], landmarks: np.ndarray) -> RegionMasks:
+        """Region masks for one face, honoring the antialias setting"""
+        return RegionMasks(image_shape, landmarks, self.region_indices, self.antialias_masks)
+
+    def region_subset(self, regions) -> np.ndarray:
+        """Sorted landmark indices covering the named regions (a list or comma-separated string)"""
+        if isinstance(regions, str):
+            regions = [name.strip() for name in regions.split(',') if name.strip()]
+        unknown = [name for name in regions if name not in self.region_indices]
+        if unknown:
+            raise ValueError(f"Unknown region(s): {', '.join(unknown)}")
+        if not regions:
+            raise ValueError("No regions given")
+        return np.unique(np.concatenate([self.region_indices[name] for name in regions]))
+
+    def _detect_faces_gated(self, image: np.ndarray) -> List[np.ndarray]:
+        """Find faces with the full-range FaceDetection model, then mesh each padded crop
+
+        Images without a detected face never reach FaceMesh, and small faces
+        in group photos (which FaceMesh's own short-range detector misses)
+        are meshed at crop resolution. With a working resolution, detection
+        runs on a downscaled copy and crops are resized before meshing, so
+        only those small images are ever color-converted. Landmarks are in
+        full-resolution pixels; faces are returned left to right.
+        """
+        faces = []
+        for box in self._detect_face_boxes(image)[:self.face_mesh_settings['max_num_faces']]:
+            landmarks = self._mesh_crop(image, box)
+            if landmarks is not None:
+                faces.append(landmarks)
+        faces.sort(key=lambda face: float(face[:, 0].min()))
+        return faces
+
+    def _detect_face_boxes(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Face boxes (x0, y0, x1, y1) in full-image pixels, most confident first, padded for FaceMesh"""
+        small = self._downscale(image, self.working_resolution)
+        with timed_stage('color_convert'):
+            rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        face_detection = self.face_detection
+        with timed_stage('inference'):
+            results = face_detection.process(rgb_small)
+        if not results.detections:
+            return []
+
+        # Detection boxes are relative, so they map straight onto the full image
+        height, width = image.shape[:2]
+        boxes = []
+        for detection in sorted(results.detections, key=lambda d: d.score[0], reverse=True):
+            box = detection.location_data.relative_bounding_box
+            pad_x = box.width * self.FACE_CROP_PADDING
+            pad_y = box.height * self.FACE_CROP_PADDING
+            x0 = max(int((box.xmin - pad_x) * width), 0)
+            y0 = max(int((box.ymin - pad_y) * height), 0)
+            x1 = min(int((box.xmin + box.width + pad_x) * width), width)
+            y1 = min(int((box.ymin + box.height + pad_y) * height), height)
+            if x1 > x0 and y1 > y0:
+                boxes.append((x0, y0, x1, y1))
+        return boxes
+
+    def _mesh_crop(self, image: np.ndarray, box: Tuple[int, int, int, int]) -> Optional[np.ndarray]:
+        """Run FaceMesh on one face crop and map its landmarks back to the full image"""
+        x0, y0, x1, y1 = box
+        crop = image[y0:y1, x0:x1]
+        if self.working_resolution:
+            crop = self._downscale(crop, self.MESH_INPUT_SIZE)
+        with timed_stage('color_convert'):
+            rgb_crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        face_mesh = self.face_mesh
+        with timed_stage('inference'):
+            results = face_mesh.process(rgb_crop)
+        if not results.multi_face_landmarks:
+            return None
+
+        # A crop can catch part of a neighbour; keep the face nearest its centre
+        def distance_from_centre(face_landmarks):
+            nose = face_landmarks.landmark[1]
+            return (nose.x - 0.5) ** 2 + (nose.y - 0.5) ** 2
+
+        face_landmarks = min(results.multi_face_landmarks, key=distance_from_centre)
+
+        # Normalized coordinates are resize-invariant: scale by the full-size crop
+        return self._extract_landmarks(face_landmarks, x1 - x0, y1 - y0, x0, y0,
+                                       z_scale=(x1 - x0) / image.shape[1])
+
+    @staticmethod
+    def _downscale(image: np.ndarray, max_side: Optional[int]) -> np.ndarray:
+        """Shrink image (keeping its aspect ratio) so its longest side is at most max_side"""
+        height, width = image.shape[:2]
+        if not max_side or max(height, width) <= max_side:
+            return image
+        scale = max_side / max(height, width)
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        with timed_stage('resize'):
+            return cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+
+    def _faces_of(self, landmark_data: Dict) -> List[np.ndarray]:
+        """Landmark arrays for every face in a detection result"""
+        if 'faces' in landmark_data:
+            return [face['landmarks'] for face in landmark_data['faces']]
+        return [landmark_data['landmarks']]
+
+    def _config_for_face(self, config: Dict, face_index: int) -> Dict:
+        """Per-face config: top-level settings, overridden by config['faces'][face_index] if given"""
+        per_face = config.get('faces')
+        if per_face is None:
+            return config
+
+        shared = {key: value for key, value in config.items() if key != 'faces'}
+        if face_index < len(per_face) and per_face[face_index] is not None:
+            return dict(shared, **per_face[face_index])
+        return shared
+
+    def _load_with_landmarks(self, source) -> Tuple[np.ndarray, Optional[Dict]]:
+        """Decode an image (path, encoded bytes or BGR array) exactly once and detect its landmarks"""
+        if isinstance(source, str):
+            image_bytes = self._read_image_bytes(source)
+            image = self._decode_image(image_bytes, source)
+            return image, self._detect_landmarks(image_bytes, image, source)
+
+        data = self._as_buffer(source)
+        image = data if isinstance(data, np.ndarray) else self._decode_image(data, '<buffer>')
+        return image, self._detect_landmarks(data, image, '<buffer>')
+
+    def encode_image(self, image: np.ndarray, output_format: str = 'jpeg',
+                     quality: Optional[int] = None) -> bytes:
+        """Encode a BGR image as JPEG, WebP or PNG bytes
+
+        quality is 0-100 for JPEG/WebP and the 0-9 compression level for PNG.
+        """
+        extension, quality_flag, default_quality = self._image_format(output_format)
+        with timed_stage('encode'):
+            ok, encoded = cv2.imencode(extension, image, [quality_flag, default_quality if quality is None else int(quality)])
+        if not ok:
+            raise ValueError(f"Could not encode image as {output_format}")
+        return encoded.tobytes()
+
+    def _image_format(self, output_format: str) -> Tuple[str, int, int]:
+        try:
+            return self.IMAGE_FORMATS[output_format.lower()]
+        except KeyError:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
+    def _save_result(self, image: np.ndarray, prefix: str, suffix: str = '',
+                     output_format: str = 'jpeg', quality: Optional[int] = None) -> str:
+        """Write a result image to uploads/ with a timestamped name"""
+        return self._write_result(self.encode_image(image, output_format, quality), prefix, suffix, output_format)
+
+    def _write_result(self, encoded: bytes, prefix: str, suffix: str = '', output_format: str = 'jpeg') -> str:
+        """Write already-encoded result bytes to uploads/ with a timestamped name"""
+        extension = self._image_format(output_format)[0]
+        timestamp = int(time.time() * 1000)
+
+        # Ensure uploads directory exists
+        with timed_stage('write'):
+            os.makedirs('uploads', exist_ok=True)
+
+            # Concurrent jobs can finish in the same millisecond; never overwrite another result
+            attempt = 0
+            while True:
+                tag = f"-{attempt}" if attempt else ''
+                output_path = os.path.join('uploads', f"{prefix}-{timestamp}{suffix}{tag}{extension}")
+                try:
+                    with open(output_path, 'xb') as f:
+                        f.write(encoded)
+                    break
+                except FileExistsError:
+                    attempt += 1
+        
+        return output_path
     
-    def apply_professional_makeup(self, image_path: str, makeup_config: Dict) -> Optional[str]:
+    def apply_professional_makeup(self, image_path: str, makeup_config: Dict,
+                                  output_format: str = 'jpeg', quality: Optional[int] = None) -> Optional[str]:
         """Apply professional makeup using MediaPipe landmarks"""
         try:
-            # Detect landmarks first
-            landmark_data = self.detect_face_landmarks(image_path)
-            if not landmark_data:
+            result_image = self._makeup_image(image_path, makeup_config)
+            if result_image is None:
                 return None
                 
-            # Load image
-            image = cv2.imread(image_path)
-            result_image = image.copy()
-            
-            landmarks = landmark_data['landmarks']
-            
-            # Apply makeup based on configuration
-            if makeup_config.get('lipstick'):
-                result_image = self._apply_lipstick(result_image, landmarks, makeup_config['lipstick'])
-                
-            if makeup_config.get('eyeshadow'):
-                result_image = self._apply_eyeshadow(result_image, landmarks, makeup_config['eyeshadow'])
-                
-            if makeup_config.get('blush'):
-                result_image = self._apply_blush(result_image, landmarks, makeup_config['blush'])
-                
-            if makeup_config.get('eyeliner'):
-                result_image = self._apply_eyeliner(result_image, landmarks, makeup_config['eyeliner'])
-                
-            if makeup_config.get('foundation'):
-                result_image = self._apply_foundation(result_image, landmarks, makeup_config['foundation'])
-                
-            # Save result with timestamp
-            timestamp = int(time.time() * 1000)
-            output_filename = f"mediapipe-makeup-{timestamp}.jpg"
-            output_path = os.path.join('uploads', output_filename)
-            
-            # Ensure uploads directory exists
-            os.makedirs('uploads', exist_ok=True)
-            cv2.imwrite(output_path, result_image)
-            
-            return output_path
+            return self._save_result(result_image, 'mediapipe-makeup', output_format=output_format, quality=quality)
             
         except Exception as e:
             print(f"Error applying makeup: {str(e)}", file=sys.stderr)
             return None
-    
-    def _apply_lipstick(self, image: np.ndarray, landmarks: List[Dict], config: Dict) -> np.ndarray:
-        """Apply lipstick using lip landmarks"""
+
+    def apply_professional_makeup_to_buffer(self, data, makeup_config: Dict, output_format: str = 'jpeg',
+                                            quality: Optional[int] = None) -> Optional[bytes]:
+        """Apply makeup to encoded image bytes or a BGR array and return the encoded result"""
         try:
-            # Get lip region points
-            lip_points = []
-            for idx in self.makeup_regions['lips']:
-                if idx < len(landmarks):
-                    lip_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-            
-            if len(lip_points) < 3:
-                return image
-                
-            # Create lip mask
-            lip_points = np.array(lip_points, dtype=np.int32)
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [lip_points], 255)
-            
-            # Apply color
-            color = config.get('color', '#FF1744')  # Default red
-            intensity = config.get('intensity', 0.7)
-            
-            # Convert hex to BGR
-            color_bgr = self._hex_to_bgr(color)
-            
-            # Create colored overlay
-            overlay = image.copy()
-            overlay[mask > 0] = color_bgr
-            
-            # Blend with original
-            result = cv2.addWeighted(image, 1-intensity, overlay, intensity, 0)
-            
-            return result
-            
+            result_image = self._makeup_image(data, makeup_config)
+            if result_image is None:
+                return None
+
+            return self.encode_image(result_image, output_format, quality)
+
         except Exception as e:
-            print(f"Error applying lipstick: {str(e)}", file=sys.stderr)
-            return image
-    
-    def _apply_eyeshadow(self, image: np.ndarray, landmarks: List[Dict], config: Dict) -> np.ndarray:
-        """Apply eyeshadow using eye landmarks"""
+            print(f"Error applying makeup: {str(e)}", file=sys.stderr)
+            return None
+
+    def _makeup_image(self, source, makeup_config: Dict) -> Optional[np.ndarray]:
+        """Decode once, detect once and render the makeup; None if no face is found"""
+        image, landmark_data = self._load_with_landmarks(source)
+        if not landmark_data:
+            return None
+        return self._composite_makeup(image, landmark_data, makeup_config)
+
+    def _composite_makeup(self, image: np.ndarray, landmark_data: Dict, makeup_config: Dict) -> np.ndarray:
+        """Render the makeup for every detected face into one copy of image"""
+        # Every face composites into the same output buffer
+        result_image = image.copy()
+        for face_index, landmarks in enumerate(self._faces_of(landmark_data)):
+            face_config = self._config_for_face(makeup_config, face_index)
+            result_image = self._render_makeup(result_image, landmarks, face_config)
+        return result_image
+
+    def apply_makeup_batch(self, image_path, makeup_configs: List[Dict], output_format: str = 'jpeg',
+                           quality: Optional[int] = None) -> Optional[List[Optional[str]]]:
+        """Render many makeup configs against one image (path, encoded bytes or BGR array)
+
+        Returns output paths in config order (None for a variant that failed),
+        or None if the image could not be loaded or has no face.
+        """
+        outputs = [None] * len(makeup_configs)
+        rendered = 0
+        for index, output_path in self.iter_makeup_batch(image_path, makeup_configs, output_format, quality):
+            outputs[index] = output_path
+            rendered += 1
+
+        if makeup_configs and not rendered:
+            return None
+        return outputs
+
+    def iter_makeup_batch(self, image_path, makeup_configs: List[Dict], output_format: str = 'jpeg',
+                          quality: Optional[int] = None) -> Iterator[Tuple[int, Optional[str]]]:
+        """Stream (index, output_path) for each config as soon as it is rendered
+
+        The image is decoded once, landmarks are detected once and region
+        masks are built once per face; each variant then starts from a fresh
+        copy of the decoded pixels. Yields nothing if no face is found.
+        """
+        def save(result_image: np.ndarray, index: int) -> str:
+            return self._save_result(result_image, 'mediapipe-makeup', f"-{index}", output_format, quality)
+
+        return self._iter_batch_variants(image_path, makeup_configs, save)
+
+    def apply_makeup_batch_to_buffer(self, data, makeup_configs: List[Dict], output_format: str = 'jpeg',
+                                     quality: Optional[int] = None) -> Optional[List[Optional[bytes]]]:
+        """Like apply_makeup_batch, but returns each variant's encoded bytes instead of writing files"""
+        def encode(result_image: np.ndarray, index: int) -> bytes:
+            return self.encode_image(result_image, output_format, quality)
+
+        outputs = [None] * len(makeup_configs)
+        rendered = 0
+        for index, encoded in self._iter_batch_variants(data, makeup_configs, encode):
+            outputs[index] = encoded
+            rendered += 1
+
+        if makeup_configs and not rendered:
+            return None
+        return outputs
+
+    def _iter_batch_variants(self, source, makeup_configs: List[Dict], output) -> Iterator[Tuple[int, Optional[object]]]:
+        """Render each config against one decode/detection and yield (index, output(result_image, index))
+
+        A variant whose rendering or output fails yields None.
+        """
         try:
-            for eye_region in ['left_eye', 'right_eye']:
-                eye_points = []
-                for idx in self.makeup_regions[eye_region]:
-                    if idx < len(landmarks):
-                        eye_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-                
-                if len(eye_points) < 3:
-                    continue
-                    
-                # Create eye mask
-                eye_points = np.array(eye_points, dtype=np.int32)
-                mask = np.zeros(image.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask, [eye_points], 255)
-                
-                # Apply eyeshadow color
-                color = config.get('color', '#8D6E63')
-                intensity = config.get('intensity', 0.5)
-                
-                color_bgr = self._hex_to_bgr(color)
-                overlay = image.copy()
-                overlay[mask > 0] = color_bgr
-                
-                image = cv2.addWeighted(image, 1-intensity, overlay, intensity, 0)
-            
-            return image
-            
+            image, landmark_data = self._load_with_landmarks(source)
         except Exception as e:
-            print(f"Error applying eyeshadow: {str(e)}", file=sys.stderr)
-            return image
-    
-    def _apply_blush(self, image: np.ndarray, landmarks: List[Dict], config: Dict) -> np.ndarray:
-        """Apply blush using cheek landmarks"""
+            print(f"Error loading batch image: {str(e)}", file=sys.stderr)
+            return
+        if not landmark_data:
+            return
+
+        faces = [(landmarks, self._region_masks(image.shape, landmarks))
+                 for landmarks in self._faces_of(landmark_data)]
+
+        for index, makeup_config in enumerate(makeup_configs):
+            try:
+                result_image = image.copy()
+                for face_index, (landmarks, masks) in enumerate(faces):
+                    face_config = self._config_for_face(makeup_config, face_index)
+                    result_image = self._render_makeup(result_image, landmarks, face_config, masks)
+                result = output(result_image, index)
+            except Exception as e:
+                print(f"Error applying makeup variant {index}: {str(e)}", file=sys.stderr)
+                result = None
+            yield index, result
+
+    def process_stream(self, source, makeup_config: Dict, frame_skip: int = 0,
+                       latency_budget_ms: Optional[float] = None,
+                       max_inference_interval: int = 6, smoothing: bool = True,
+                       tracker: Optional[TemporalLandmarkTracker] = None,
+                       fps: Optional[float] = None) -> Iterator[Dict]:
+        """Apply makeup frame by frame to a video file, camera index or iterable of BGR frames
+
+        Uses a FaceMesh in tracking mode (static_image_mode=False, honoring
+        min_tracking_confidence), so full detection only runs when the face is
+        lost. Yields {'index', 'frame', 'landmarks', 'faces', 'inferred',
+        'latency_ms'} per processed frame ('landmarks' is the first face).
+
+        frame_skip drops that many input frames after each processed one.
+        With latency_budget_ms, landmark inference is run on fewer frames
+        (reusing the previous landmarks in between, up to
+        max_inference_interval) while the recent average frame time is over
+        budget, and recovers once it is back under.
+
+        With smoothing, landmarks go through a TemporalLandmarkTracker (pass
+        your own to read its stats afterwards) and region masks are reused
+        between frames; each result then also carries 'mask_action'.
+        """
+        tracking_mesh = self.mp_face_mesh.FaceMesh(**dict(self.face_mesh_settings, static_image_mode=False))
+        if smoothing and tracker is None:
+            tracker = TemporalLandmarkTracker(self.region_indices, antialias=self.antialias_masks)
+        fps = fps or self._source_fps(source)
+        inference_interval = 1
+        frames_since_inference = 0
+        average_ms = None
+        faces = []
+
         try:
-            for cheek_region in ['cheeks_left', 'cheeks_right']:
-                cheek_points = []
-                for idx in self.makeup_regions[cheek_region]:
-                    if idx < len(landmarks):
-                        cheek_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-                
-                if len(cheek_points) < 3:
+            for index, frame in enumerate(self._iter_frames(source)):
+                if frame_skip and index % (frame_skip + 1):
                     continue
-                    
-                # Create cheek mask with gradient effect
-                cheek_points = np.array(cheek_points, dtype=np.int32)
-                
-                # Find center of cheek region
-                center_x = int(np.mean([p[0] for p in cheek_points]))
-                center_y = int(np.mean([p[1] for p in cheek_points]))
-                
-                # Create circular blush
-                color = config.get('color', '#F8BBD9')
-                intensity = config.get('intensity', 0.4)
-                radius = config.get('radius', 30)
-                
-                color_bgr = self._hex_to_bgr(color)
-                
-                # Create gradient mask
-                mask = np.zeros(image.shape[:2], dtype=np.float32)
-                cv2.circle(mask, (center_x, center_y), radius, 1.0, -1)
-                
-                # Apply Gaussian blur for natural look
-                mask = cv2.GaussianBlur(mask, (31, 31), 0)
-                
-                # Apply blush
-                for c in range(3):
-                    image[:, :, c] = image[:, :, c] * (1 - mask * intensity) + color_bgr[c] * mask * intensity
-            
-            return image.astype(np.uint8)
-            
-        except Exception as e:
-            print(f"Error applying blush: {str(e)}", file=sys.stderr)
-            return image
-    
-    def _apply_eyeliner(self, image: np.ndarray, landmarks: List[Dict], config: Dict) -> np.ndarray:
-        """Apply eyeliner using eye landmarks"""
+
+                start = time.perf_counter()
+                inferred = not faces or frames_since_inference >= inference_interval
+                if inferred:
+                    faces = self._track_faces(tracking_mesh, frame)
+                    frames_since_inference = 0
+                frames_since_inference += 1
+
+                output = frame.copy()
+                frame_faces, mask_action = [], None
+                for face_id, landmarks in enumerate(faces):
+                    masks = None
+                    if smoothing:
+                        landmarks, masks, action = tracker.update(face_id, landmarks, index / fps, frame.shape)
+                        mask_action = mask_action or action
+                    face_config = self._config_for_face(makeup_config, face_id)
+                    output = self._render_makeup(output, landmarks, face_config, masks)
+                    frame_faces.append(landmarks)
+                if smoothing:
+                    tracker.retain(range(len(faces)))
+                latency_ms = (time.perf_counter() - start) * 1000
+
+                if latency_budget_ms:
+                    average_ms = latency_ms if average_ms is None else 0.8 * average_ms + 0.2 * latency_ms
+                    if average_ms > latency_budget_ms and inference_interval < max_inference_interval:
+                        inference_interval += 1
+                    elif average_ms < 0.7 * latency_budget_ms and inference_interval > 1:
+                        inference_interval -= 1
+
+                yield {
+                    'index': index,
+                    'frame': output,
+                    'landmarks': frame_faces[0] if frame_faces else None,
+                    'faces': frame_faces,
+                    'inferred': inferred,
+                    'mask_action': mask_action,
+                    'latency_ms': latency_ms
+                }
+        finally:
+            tracking_mesh.close()
+
+    def process_video(self, source, makeup_config: Dict, output_path: Optional[str] = None,
+                      **stream_options) -> Optional[Dict]:
+        """Run process_stream over a video/camera and write the result to a video file"""
+        writer = None
+        frames = 0
+        faces = 0
+        total_ms = 0.0
+        start = time.perf_counter()
+        if stream_options.get('smoothing', True) and stream_options.get('tracker') is None:
+            stream_options['tracker'] = TemporalLandmarkTracker(self.region_indices, antialias=self.antialias_masks)
+
         try:
-            color = config.get('color', '#000000')
-            thickness = config.get('thickness', 2)
-            
-            color_bgr = self._hex_to_bgr(color)
-            
-            # Apply to both eyes
-            for eye_region in ['left_eye', 'right_eye']:
-                eye_points = []
-                for idx in self.makeup_regions[eye_region]:
-                    if idx < len(landmarks):
-                        eye_points.append((landmarks[idx]['x'], landmarks[idx]['y']))
-                
-                if len(eye_points) > 1:
-                    # Draw eyeliner along upper eyelid
-                    upper_eyelid = eye_points[:len(eye_points)//2]
-                    for i in range(len(upper_eyelid) - 1):
-                        cv2.line(image, upper_eyelid[i], upper_eyelid[i+1], color_bgr, thickness)
-            
-            return image
-            
+            if output_path is None:
+                os.makedirs('uploads', exist_ok=True)
+                output_path = os.path.join('uploads', f"mediapipe-video-{int(time.time() * 1000)}.mp4")
+            fps = stream_options.pop('fps', None) or self._source_fps(source)
+
+            for result in self.process_stream(source, makeup_config, fps=fps, **stream_options):
+                frame = result['frame']
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    # Dropped frames are not written, so keep the output's duration
+                    output_fps = fps / (stream_options.get('frame_skip', 0) + 1)
+                    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), output_fps,
+                                             (width, height))
+                writer.write(frame)
+
+                frames += 1
+                faces += 1 if result['landmarks'] is not None else 0
+                total_ms += result['latency_ms']
+
         except Exception as e:
-            print(f"Error applying eyeliner: {str(e)}", file=sys.stderr)
-            return image
-    
-    def _apply_foundation(self, image: np.ndarray, landmarks: List[Dict], config: Dict) -> np.ndarray:
+            print(f"Error processing video: {str(e)}", file=sys.stderr)
+            return None
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if not frames:
+            return None
+
+        elapsed = time.perf_counter() - start
+        summary = {
+            'output_path': output_path,
+            'frames': frames,
+            'frames_with_face': faces,
+            'avg_frame_ms': total_ms / frames,
+            'fps': frames / elapsed if elapsed else 0.0
+        }
+        if stream_options.get('tracker') is not None:
+            summary['mask_reuse'] = stream_options['tracker'].stats()
+        return summary
+
+    def _track_faces(self, tracking_mesh, frame: np.ndarray) -> List[np.ndarray]:
+        """Run a tracking-mode FaceMesh on one BGR frame; one landmark array per face"""
+        results = tracking_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        height, width = frame.shape[:2]
+        return [self._extract_landmarks(face_landmarks, width, height)
+                for face_landmarks in results.multi_face_landmarks or []]
+
+    def _iter_frames(self, source) -> Iterator[np.ndarray]:
+        """Frames from a video path, a camera index (int or digit string) or any iterable of arrays"""
+        if not isinstance(source, (str, int)):
+            yield from source
+            return
+
+        capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video source: {source}")
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame
+        finally:
+            capture.release()
+
+    def _source_fps(self, source, default: float = 30.0) -> float:
+        """Frame rate reported by a video source, for writing the output"""
+        if not isinstance(source, (str, int)):
+            return default
+        capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        fps = capture.get(cv2.CAP_PROP_FPS) if capture.isOpened() else 0
+        capture.release()
+        return fps if fps and fps > 0 else default
+
+    def _render_makeup(self, result_image: np.ndarray, landmarks: np.ndarray, makeup_config: Dict,
+                       masks: Optional[RegionMasks] = None) -> np.ndarray:
+        """Apply every configured effect, in order, to result_image (in place)"""
+        if masks is None:
+            masks = self._region_masks(result_image.shape, landmarks)
+
+        plan = self.compile_makeup(makeup_config)
+        count_event('effects_applied', len(plan.effects))
+        with timed_stage('blend'):
+            self._run_plan(result_image, landmarks, plan, masks)
+
+        return result_image
+
+    def compile_makeup(self, makeup_config: Dict) -> MakeupPlan:
+        """Compile a makeup_config into an ordered layer plan, reusing cached plans for repeated looks"""
+        try:
+            key = json.dumps(makeup_config, sort_keys=True)
+        except (TypeError, ValueError):
+            key = None
+
+        if key is not None:
+            with self._plan_lock:
+                plan = self._plan_cache.get(key)
+                if plan is not None:
+                    self._plan_cache.move_to_end(key)
+            if plan is not None:
+                count_event('plan_cache_hits')
+                return plan
+
+        layers, effects = [], []
+        for effect in self.MAKEUP_EFFECTS:
+            if not makeup_config.get(effect):
+                continue
+            try:
+                layers.extend(getattr(self, f'_{effect}_layers')(makeup_config[effect]))
+                effects.append(effect)
+            except Exception as e:
+                print(f"Error applying {effect}: {str(e)}", file=sys.stderr)
+
+        plan = MakeupPlan(layers, effects)
+        if key is not None:
+            with self._plan_lock:
+                self._plan_cache[key] = plan
+                if len(self._plan_cache) > self.PLAN_CACHE_SIZE:
+                    self._plan_cache.popitem(last=False)
+        return plan
+
+    def _lipstick_layers(self, config: Dict) -> List[MakeupLayer]:
+        color_bgr = self._hex_to_bgr(config.get('color', '#FF1744'))  # Default red
+        return [MakeupLayer('lipstick', 'color', 'lips', color_bgr, config.get('intensity', 0.7))]
+
+    def _eyeshadow_layers(self, config: Dict) -> List[MakeupLayer]:
+        color_bgr = self._hex_to_bgr(config.get('color', '#8D6E63'))
+        intensity = config.get('intensity', 0.5)
+        return [MakeupLayer('eyeshadow', 'color', eye_region, color_bgr, intensity)
+                for eye_region in ['left_eye', 'right_eye']]
+
+    def _blush_layers(self, config: Dict) -> List[MakeupLayer]:
+        color_bgr = self._hex_to_bgr(config.get('color', '#F8BBD9'))
+        intensity = config.get('intensity', 0.4)
+        radius = int(config.get('radius', 30))
+        return [MakeupLayer('blush', 'spot', cheek_region, color_bgr, intensity, size=radius)
+                for cheek_region in ['cheeks_left', 'cheeks_right']]
+
+    def _eyeliner_layers(self, config: Dict) -> List[MakeupLayer]:
+        color_bgr = self._hex_to_bgr(config.get('color', '#000000'))
+        thickness = config.get('thickness', 2)
+        return [MakeupLayer('eyeliner', 'stroke', eye_region, color_bgr, size=thickness)
+                for eye_region in ['left_eye', 'right_eye']]
+
+    def _foundation_layers(self, config: Dict) -> List[MakeupLayer]:
+        # Padded so the filter sees real neighbours at the ROI edge
+        return [MakeupLayer('foundation', 'smooth', 'face_outline', intensity=config.get('intensity', 0.3),
+                            min_points=10, padding=self.FOUNDATION_FILTER_DIAMETER // 2)]
+
+    def _run_plan(self, image: np.ndarray, landmarks: np.ndarray, plan: MakeupPlan,
+                  masks: Optional[RegionMasks] = None) -> np.ndarray:
+        """Composite a plan's layers, in order, into image in place; every layer touches only its ROI"""
+        masks = masks or self._region_masks(image.shape, landmarks)
+        for layer in plan.layers:
+            try:
+                if layer.kind == 'color':
+                    mask = masks.get(layer.region, layer.min_points, layer.padding)
+                    if mask is not None:
+                        self._blend_color(image, mask, layer.color_bgr, layer.intensity)
+                elif layer.kind == 'spot':
+                    self._draw_spot(image, landmarks, layer)
+                elif layer.kind == 'stroke':
+                    self._draw_stroke(image, landmarks, layer)
+                elif layer.kind == 'smooth':
+                    mask = masks.get(layer.region, layer.min_points, layer.padding)
+                    if mask is not None:
+                        self._smooth_region(image, mask, layer.intensity)
+            except Exception as e:
+                print(f"Error applying {layer.effect}: {str(e)}", file=sys.stderr)
+        return image
+
+    def _apply_lipstick(self, image: np.ndarray, landmarks: np.ndarray, config: Dict,
+                        masks: Optional[RegionMasks] = None) -> np.ndarray:
+        """Apply lipstick using lip landmarks"""
+        return self._run_effect('lipstick', image, landmarks, config, masks)
+
+    def _apply_eyeshadow(self, image: np.ndarray, landmarks: np.ndarray, config: Dict,
+                         masks: Optional[RegionMasks] = None) -> np.ndarray:
+        """Apply eyeshadow using eye landmarks"""
+        return self._run_effect('eyeshadow', image, landmarks, config, masks)
+
+    def _apply_blush(self, image: np.ndarray, landmarks: np.ndarray, config: Dict) -> np.ndarray:
+        """Apply blush using cheek landmarks"""
+        return self._run_effect('blush', image, landmarks, config)
+
+    def _apply_eyeliner(self, image: np.ndarray, landmarks: np.ndarray, config: Dict) -> np.ndarray:
+        """Apply eyeliner using eye landmarks"""
+        return self._run_effect('eyeliner', image, landmarks, config)
+
+    def _apply_foundation(self, image: np.ndarray, landmarks: np.ndarray, config: Dict,
+                          masks: Optional[RegionMasks] = None) -> np.ndarray:
         """Apply foundation for skin smoothing"""
+        return self._run_effect('foundation', image, landmarks, config, masks)
+
+    def _run_effect(self, effect: str, image: np.ndarray, landmarks: np.ndarray, config: Dict,
+                    masks: Optional[RegionMasks] = None) -> np.ndarray:
+        """Run a single effect's layers on image, in place (its defaults apply even to an empty config)"""
         try:
-            # Get face boundary
-            face_points = []
-            face_outline_indices = [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377, 152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
-            
-            for idx in face_outline_indices:
-                if idx < len(landmarks):
-                    face_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-            
-            if len(face_points) < 10:
-                return image
-                
-            # Create face mask
-            face_points = np.array(face_points, dtype=np.int32)
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [face_points], 255)
-            
-            # Apply smoothing
-            smoothed = cv2.bilateralFilter(image, 15, 80, 80)
-            
-            # Blend with original
-            intensity = config.get('intensity', 0.3)
-            result = image.copy()
-            result[mask > 0] = cv2.addWeighted(
-                image[mask > 0], 1-intensity, 
-                smoothed[mask > 0], intensity, 0
-            )
-            
-            return result
-            
+            plan = MakeupPlan(getattr(self, f'_{effect}_layers')(config), [effect])
         except Exception as e:
-            print(f"Error applying foundation: {str(e)}", file=sys.stderr)
+            print(f"Error applying {effect}: {str(e)}", file=sys.stderr)
             return image
+        return self._run_plan(image, landmarks, plan, masks)
+
+    def _draw_spot(self, image: np.ndarray, landmarks: np.ndarray, layer: MakeupLayer) -> None:
+        """Blend a blurred circle (blush) at the centre of the layer's region"""
+        points = region_points(landmarks, self.region_indices[layer.region]).astype(np.int32)
+        if len(points) < layer.min_points:
+            return
+
+        # Find center of cheek region
+        center_x = int(np.mean(points[:, 0]))
+        center_y = int(np.mean(points[:, 1]))
+        radius = layer.size
+        height, width = image.shape[:2]
+
+        # The blurred circle never reaches past radius + kernel half-width,
+        # so the whole effect lives in this ROI
+        reach = radius + self.BLUSH_BLUR_SIZE // 2 + 1
+        x0, x1 = max(center_x - reach, 0), min(center_x + reach + 1, width)
+        y0, y1 = max(center_y - reach, 0), min(center_y + reach + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        # Create gradient mask
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+        cv2.circle(mask, (center_x - x0, center_y - y0), radius, 1.0, -1)
+
+        # Apply Gaussian blur for natural look
+        mask = cv2.GaussianBlur(mask, (self.BLUSH_BLUR_SIZE, self.BLUSH_BLUR_SIZE), 0)
+        mask *= layer.intensity
+
+        self._blend_soft(image, (slice(y0, y1), slice(x0, x1)), mask, layer.color_bgr)
+
+    def _draw_stroke(self, image: np.ndarray, landmarks: np.ndarray, layer: MakeupLayer) -> None:
+        """Draw a line (eyeliner) along the first half of the layer's region outline"""
+        points = [tuple(point) for point in
+                  region_points(landmarks, self.region_indices[layer.region]).astype(int).tolist()]
+        if len(points) > 1:
+            # Draw eyeliner along upper eyelid
+            upper_eyelid = points[:len(points)//2]
+            for i in range(len(upper_eyelid) - 1):
+                cv2.line(image, upper_eyelid[i], upper_eyelid[i+1], layer.color_bgr, layer.size)
+
+    def _smooth_region(self, image: np.ndarray, mask: RegionMask, intensity: float) -> None:
+        """Blend a bilateral-filtered copy (foundation) into the masked pixels, filtering only the ROI"""
+        roi = image[mask.roi]
+        smoothed = cv2.bilateralFilter(roi, self.FOUNDATION_FILTER_DIAMETER, 80, 80)
+
+        # Blend with original
+        selected = mask.mask > 0
+        roi[selected] = cv2.addWeighted(
+            roi[selected], 1-intensity,
+            smoothed[selected], intensity, 0
+        )
+
+    def _blend_color(self, image: np.ndarray, region: RegionMask, color_bgr: Tuple[int, int, int],
+                     intensity: float) -> None:
+        """Blend a flat color into the masked pixels, in place, touching only the region's ROI"""
+        if region.soft:
+            # Antialiased coverage acts as per-pixel alpha
+            alpha = region.mask.astype(np.float32)
+            alpha *= intensity / 255.0
+            self._blend_soft(image, region.roi, alpha, color_bgr)
+            return
+
+        roi = image[region.roi]
+        overlay = roi.copy()
+        overlay[region.mask > 0] = color_bgr
+        roi[:] = cv2.addWeighted(roi, 1-intensity, overlay, intensity, 0)
+
+    def _adjust_region(self, image: np.ndarray, region: RegionMask, alpha: float, beta: float) -> None:
+        """Scale and offset the masked pixels (saturating), in place"""
+        roi = image[region.roi]
+        selected = region.mask > 0
+        roi[selected] = cv2.addWeighted(roi[selected], alpha, roi[selected], 0, beta)
+    
+    def _blend_soft(self, image: np.ndarray, roi: Tuple[slice, slice], alpha: np.ndarray,
+                    color_bgr: Tuple[int, int, int]) -> None:
+        """Blend a color through a per-pixel float alpha into image[roi], in place
+
+        All channels are blended in one broadcast float32 pass
+        (image + (color - image) * alpha), then rounded and clipped straight
+        back into the uint8 image.
+        """
+        target = image[roi]
+        work = target.astype(np.float32)
+        delta = np.subtract(np.array(color_bgr, dtype=np.float32), work)
+        delta *= alpha[..., np.newaxis]
+        work += delta
+        np.rint(work, out=work)
+        np.clip(work, 0, 255, out=work)
+        np.copyto(target, work, casting='unsafe')
     
     def _hex_to_bgr(self, hex_color: str) -> Tuple[int, int, int]:
         """Convert hex color to BGR tuple"""
@@ -321,68 +1769,79 @@ class MediaPipeFaceProcessor:
         rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
         return (rgb[2], rgb[1], rgb[0])  # Convert RGB to BGR
     
-    def enhance_facial_features(self, image_path: str, enhancement_config: Dict) -> Optional[str]:
-        """Enhance facial features using advanced MediaPipe processing"""
-        try:
-            landmark_data = self.detect_face_landmarks(image_path)
-            if not landmark_data:
-                return None
-                
-            image = cv2.imread(image_path)
-            result_image = image.copy()
-            landmarks = landmark_data['landmarks']
-            
-            # Enhance eyes
-            if enhancement_config.get('enhance_eyes', True):
-                result_image = self._enhance_eyes(result_image, landmarks)
-            
-            # Enhance nose
-            if enhancement_config.get('enhance_nose', True):
-                result_image = self._enhance_nose(result_image, landmarks)
-            
-            # Enhance lips
-            if enhancement_config.get('enhance_lips', True):
-                result_image = self._enhance_lips(result_image, landmarks)
-            
-            # Save result with timestamp
-            timestamp = int(time.time() * 1000)
-            output_filename = f"mediapipe-enhanced-{timestamp}.jpg"
-            output_path = os.path.join('uploads', output_filename)
-            
-            # Ensure uploads directory exists
-            os.makedirs('uploads', exist_ok=True)
-            cv2.imwrite(output_path, result_image)
+    def enhance_facial_features(self, image_path: str, enhancement_config: Dict,
+                                output_format: str = 'jpeg', quality: Optional[int] = None) -> Optional[str]:
+        """Enhance facial features using advanced MediaPipe processing"""
+        try:
+            result_image = self._enhance_image(image_path, enhancement_config)
+            if result_image is None:
+                return None
             
-            return output_path
+            return self._save_result(result_image, 'mediapipe-enhanced', output_format=output_format, quality=quality)
             
         except Exception as e:
             print(f"Error enhancing features: {str(e)}", file=sys.stderr)
             return None
+
+    def enhance_facial_features_to_buffer(self, data, enhancement_config: Dict, output_format: str = 'jpeg',
+                                          quality: Optional[int] = None) -> Optional[bytes]:
+        """Enhance encoded image bytes or a BGR array and return the encoded result"""
+        try:
+            result_image = self._enhance_image(data, enhancement_config)
+            if result_image is None:
+                return None
+
+            return self.encode_image(result_image, output_format, quality)
+
+        except Exception as e:
+            print(f"Error enhancing features: {str(e)}", file=sys.stderr)
+            return None
+
+    def _enhance_image(self, source, enhancement_config: Dict) -> Optional[np.ndarray]:
+        """Decode once, detect once and apply the enhancements; None if no face is found"""
+        image, landmark_data = self._load_with_landmarks(source)
+        if not landmark_data:
+            return None
+        return self._composite_enhancements(image, landmark_data, enhancement_config)
+
+    def _composite_enhancements(self, image: np.ndarray, landmark_data: Dict,
+                                enhancement_config: Dict) -> np.ndarray:
+        """Apply the enhancements for every detected face to one copy of image"""
+        result_image = image.copy()
+        for face_index, landmarks in enumerate(self._faces_of(landmark_data)):
+            face_config = self._config_for_face(enhancement_config, face_index)
+            masks = self._region_masks(image.shape, landmarks)
+            
+            count_event('effects_applied', sum(
+                1 for name in ('enhance_eyes', 'enhance_nose', 'enhance_lips') if face_config.get(name, True)))
+            with timed_stage('blend'):
+                # Enhance eyes
+                if face_config.get('enhance_eyes', True):
+                    result_image = self._enhance_eyes(result_image, landmarks, masks)
+
+                # Enhance nose
+                if face_config.get('enhance_nose', True):
+                    result_image = self._enhance_nose(result_image, landmarks)
+
+                # Enhance lips
+                if face_config.get('enhance_lips', True):
+                    result_image = self._enhance_lips(result_image, landmarks, masks)
+
+        return result_image
     
-    def _enhance_eyes(self, image: np.ndarray, landmarks: List[Dict]) -> np.ndarray:
+    def _enhance_eyes(self, image: np.ndarray, landmarks: np.ndarray,
+                      masks: Optional[RegionMasks] = None) -> np.ndarray:
         """Enhance eye brightness and definition"""
         try:
+            masks = masks or self._region_masks(image.shape, landmarks)
             for eye_region in ['left_eye', 'right_eye']:
-                eye_points = []
-                for idx in self.makeup_regions[eye_region]:
-                    if idx < len(landmarks):
-                        eye_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-                
-                if len(eye_points) < 3:
+                # Get eye mask
+                mask = masks.get(eye_region)
+                if mask is None:
                     continue
-                    
-                # Create eye mask
-                eye_points = np.array(eye_points, dtype=np.int32)
-                mask = np.zeros(image.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask, [eye_points], 255)
                 
                 # Enhance brightness and contrast
-                enhanced = image.copy()
-                enhanced[mask > 0] = cv2.addWeighted(
-                    enhanced[mask > 0], 1.2, enhanced[mask > 0], 0, 10
-                )
-                
-                image = enhanced
+                self._adjust_region(image, mask, 1.2, 10)
             
             return image
             
@@ -390,20 +1849,15 @@ class MediaPipeFaceProcessor:
             print(f"Error enhancing eyes: {str(e)}", file=sys.stderr)
             return image
     
-    def _enhance_nose(self, image: np.ndarray, landmarks: List[Dict]) -> np.ndarray:
+    def _enhance_nose(self, image: np.ndarray, landmarks: np.ndarray) -> np.ndarray:
         """Enhance nose definition and contour"""
         try:
-            nose_points = []
-            for idx in self.makeup_regions['nose']:
-                if idx < len(landmarks):
-                    nose_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
+            nose_points = region_points(landmarks, self.region_indices['nose']).astype(int).tolist()
             
             if len(nose_points) < 5:
                 return image
                 
             # Apply subtle contouring
-            nose_points = np.array(nose_points, dtype=np.int32)
-            
             # Create nose bridge highlight
             bridge_points = nose_points[:len(nose_points)//2]
             for i in range(len(bridge_points) - 1):
@@ -415,69 +1869,1229 @@ class MediaPipeFaceProcessor:
             print(f"Error enhancing nose: {str(e)}", file=sys.stderr)
             return image
     
-    def _enhance_lips(self, image: np.ndarray, landmarks: List[Dict]) -> np.ndarray:
+    def _enhance_lips(self, image: np.ndarray, landmarks: np.ndarray,
+                      masks: Optional[RegionMasks] = None) -> np.ndarray:
         """Enhance lip definition and color"""
         try:
-            lip_points = []
-            for idx in self.makeup_regions['lips']:
-                if idx < len(landmarks):
-                    lip_points.append([landmarks[idx]['x'], landmarks[idx]['y']])
-            
-            if len(lip_points) < 3:
+            # Get lip mask
+            masks = masks or self._region_masks(image.shape, landmarks)
+            mask = masks.get('lips')
+            if mask is None:
                 return image
-                
-            # Create lip mask
-            lip_points = np.array(lip_points, dtype=np.int32)
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [lip_points], 255)
             
             # Enhance lip color saturation
-            enhanced = image.copy()
-            enhanced[mask > 0] = cv2.addWeighted(
-                enhanced[mask > 0], 1.1, enhanced[mask > 0], 0, 5
-            )
+            self._adjust_region(image, mask, 1.1, 5)
             
-            return enhanced
+            return image
             
         except Exception as e:
             print(f"Error enhancing lips: {str(e)}", file=sys.stderr)
             return image
 
+def run_action(processor: MediaPipeFaceProcessor, action: str, image,
+               config: Optional[Dict] = None, options: Optional[Dict] = None) -> Tuple[Dict, bool]:
+    """Run a single CLI action and return (response, success)
+
+    image is a file path, or encoded bytes / a BGR array for in-memory jobs,
+    whose makeup/enhance results come back base64-encoded under 'image_b64'
+    (makeup_batch: one such entry per variant under 'images') instead of
+    being written to uploads/. options may set 'output_format'
+    (jpeg/webp/png) and 'quality', and for landmarks 'landmark_format'
+    (json/compact/binary) and 'regions' to return only those regions' points.
+    With 'timings' (or 'profile_interval_ms', which also samples the stack)
+    the response gains a 'timings' key with per-stage milliseconds and counters.
+    """
+    options = options or {}
+    if not options.get('timings') and not options.get('profile_interval_ms'):
+        return _run_action(processor, action, image, config, options)
+
+    profiler = None
+    if options.get('profile_interval_ms'):
+        profiler = SamplingProfiler(options['profile_interval_ms'] / 1000)
+    with RequestTimings(profiler) as timings:
+        response, ok = _run_action(processor, action, image, config, options)
+    return dict(response, timings=timings.as_dict()), ok
+
+
+def _run_action(processor: MediaPipeFaceProcessor, action: str, image,
+                config: Optional[Dict], options: Dict) -> Tuple[Dict, bool]:
+    encoding = {'output_format': options.get('output_format', 'jpeg'), 'quality': options.get('quality')}
+    in_memory = not isinstance(image, str)
+
+    if action == 'landmarks':
+        if in_memory:
+            landmarks = processor.detect_face_landmarks_from_buffer(image)
+        else:
+            landmarks = processor.detect_face_landmarks(image)
+        if landmarks:
+            indices = None
+            if options.get('regions'):
+                indices = processor.region_subset(options['regions'])
+            return format_landmark_data(landmarks, options.get('landmark_format', 'json'), indices), True
+        return {"success": False, "error": "No face detected"}, False
+
+    if action == 'makeup':
+        if in_memory:
+            result = processor.apply_professional_makeup_to_buffer(image, config or {}, **encoding)
+            if result:
+                return _encoded_response(result, encoding['output_format']), True
+        else:
+            result_path = processor.apply_professional_makeup(image, config or {}, **encoding)
+            if result_path:
+                return {"success": True, "output_path": result_path}, True
+        return {"success": False, "error": "Failed to apply makeup"}, False
+
+    if action == 'makeup_batch':
+        if in_memory:
+            # Variants come back inline, one single-makeup-shaped entry each
+            results = processor.apply_makeup_batch_to_buffer(image, _batch_configs(config), **encoding)
+            if results is not None:
+                images = [_encoded_response(result, encoding['output_format']) if result is not None
+                          else {"success": False, "error": "Failed to apply makeup"} for result in results]
+                return {"success": True, "images": images}, True
+        else:
+            result_paths = processor.apply_makeup_batch(image, _batch_configs(config), **encoding)
+            if result_paths is not None:
+                return {"success": True, "output_paths": result_paths}, True
+        return {"success": False, "error": "Failed to apply makeup"}, False
+
+    if action == 'enhance':
+        if in_memory:
+            result = processor.enhance_facial_features_to_buffer(image, config or {}, **encoding)
+            if result:
+                return _encoded_response(result, encoding['output_format']), True
+        else:
+            result_path = processor.enhance_facial_features(image, config or {}, **encoding)
+            if result_path:
+                return {"success": True, "output_path": result_path}, True
+        return {"success": False, "error": "Failed to enhance features"}, False
+
+    return {"success": False, "error": f"Unknown action: {action}"}, False
+
+
+def _encoded_response(data: bytes, output_format: str) -> Dict:
+    return {"success": True, "image_b64": base64.b64encode(data).decode('ascii'), "format": output_format}
+
+
+def _batch_configs(config) -> List[Dict]:
+    """Accept either a bare list of makeup configs or {"configs": [...]}"""
+    if isinstance(config, list):
+        return config
+    return (config or {}).get('configs', [])
+
+
+# Files picked up from a --input directory; extensionless names are raw uploads
+BULK_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+BULK_ACTIONS = ('landmarks', 'makeup', 'enhance')
+
+
+def load_bulk_jobs(source: str, default_action: str = 'makeup',
+                   default_config: Optional[Dict] = None) -> List[Dict]:
+    """Jobs from a directory of images or a JSONL manifest
+
+    Manifest lines look like {"image": ..., "action": ..., "config": ...,
+    "output": ..., "id": ...}; only "image" is required. Directory jobs use
+    default_action and default_config for every image.
+    """
+    if os.path.isdir(source):
+        jobs = []
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            extension = os.path.splitext(name)[1].lower()
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            if extension and extension not in BULK_IMAGE_EXTENSIONS:
+                continue
+            jobs.append({'image': path, 'action': default_action, 'config': default_config})
+        return jobs
+
+    jobs = []
+    with open(source, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if not isinstance(job, dict) or not job.get('image'):
+                raise ValueError(f"{source}:{line_number}: each manifest line needs an 'image'")
+            job.setdefault('action', default_action)
+            if 'config' not in job:
+                job['config'] = default_config
+            if job['action'] not in BULK_ACTIONS:
+                raise ValueError(f"{source}:{line_number}: unsupported action {job['action']!r}")
+            jobs.append(job)
+    return jobs
+
+
+def bulk_job_key(job: Dict) -> str:
+    """Stable identity of a job for checkpointing: its id, or a hash of image, action and config"""
+    if job.get('id') is not None:
+        return str(job['id'])
+    identity = json.dumps([job['image'], job['action'], job.get('config')], sort_keys=True)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+
+
+def read_bulk_checkpoint(results_path: Optional[str]) -> set:
+    """Keys of jobs that already succeeded in an earlier run's results file"""
+    done = set()
+    if not results_path or not os.path.exists(results_path):
+        return done
+    with open(results_path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if isinstance(result, dict) and result.get('success') and result.get('key'):
+                done.add(result['key'])
+    return done
+
+
+def run_bulk(runner, jobs: List[Dict], results_stream, options: Optional[Dict] = None,
+             done_keys: Optional[set] = None, overwrite: bool = False, progress_every: int = 100) -> Dict:
+    """Run jobs through runner, streaming one JSONL result per job, and return a throughput summary
+
+    Jobs whose key is in done_keys, or whose 'output' file already exists,
+    are skipped unless overwrite is set. Results with an 'output' are moved
+    (images) or written (landmarks JSON) there.
+    """
+    from concurrent.futures import Future
+
+    options = options or {}
+    done_keys = done_keys or set()
+    write_lock = threading.Lock()
+    latencies = []
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    pending = []
+    started = time.perf_counter()
+
+    # A future's waiters wake before its callbacks run, so the summary waits on
+    # the callbacks themselves: reported[0] counts those that have finished
+    reported = [0]
+    all_reported = threading.Condition()
+
+    def emit(result: Dict) -> None:
+        with write_lock:
+            results_stream.write(json.dumps(result, separators=(',', ':')) + '\n')
+            results_stream.flush()
+            finished = counts['succeeded'] + counts['failed']
+            if progress_every and finished and finished % progress_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"Processed {finished + counts['skipped']}/{len(jobs)} jobs "
+                      f"({finished / elapsed:.1f} jobs/s)", file=sys.stderr)
+
+    def on_done(job: Dict, key: str, submitted: float, job_future: 'Future') -> None:
+        elapsed_ms = (time.perf_counter() - submitted) * 1000
+        try:
+            try:
+                response = job_future.result()
+                if response.get('success', True) and job.get('output'):
+                    response = _store_bulk_output(job, response)
+            except Exception as e:
+                response = {"success": False, "error": str(e) or type(e).__name__}
+
+            ok = bool(response.get('success', True))
+            with write_lock:
+                counts['succeeded' if ok else 'failed'] += 1
+                latencies.append(elapsed_ms)
+            emit(dict(response, success=ok, key=key, image=job['image'], action=job['action'],
+                      elapsed_ms=round(elapsed_ms, 3)))
+        finally:
+            with all_reported:
+                reported[0] += 1
+                all_reported.notify_all()
+
+    for job in jobs:
+        key = bulk_job_key(job)
+        if not overwrite and (key in done_keys or (job.get('output') and os.path.exists(job['output']))):
+            with write_lock:
+                counts['skipped'] += 1
+            continue
+
+        job_options = dict(options)
+        if job.get('output') and job['action'] != 'landmarks':
+            # Encode in the format the destination's extension asks for
+            extension = os.path.splitext(job['output'])[1].lower().lstrip('.')
+            if extension in MediaPipeFaceProcessor.IMAGE_FORMATS:
+                job_options['output_format'] = extension
+
+        submitted = time.perf_counter()
+        try:
+            job_future = runner.submit(job['action'], job['image'], job.get('config') or {}, job_options)
+        except Exception as e:
+            job_future = Future()
+            job_future.set_exception(e)
+        job_future.add_done_callback(lambda f, job=job, key=key, submitted=submitted: on_done(job, key, submitted, f))
+        pending.append(job_future)
+
+    with all_reported:
+        all_reported.wait_for(lambda: reported[0] == len(pending))
+
+    elapsed = time.perf_counter() - started
+    processed = counts['succeeded'] + counts['failed']
+    summary = dict(counts, total=len(jobs), elapsed_s=round(elapsed, 3),
+                   jobs_per_s=round(processed / elapsed, 3) if elapsed and processed else 0.0)
+    if latencies:
+        summary['p50_ms'] = round(float(np.percentile(latencies, 50)), 3)
+        summary['p95_ms'] = round(float(np.percentile(latencies, 95)), 3)
+    return summary
+
+
+def _store_bulk_output(job: Dict, response: Dict) -> Dict:
+    """Put a finished job's result at the job's requested 'output' path"""
+    destination = job['output']
+    directory = os.path.dirname(destination)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if job['action'] == 'landmarks':
+        with open(destination, 'w') as f:
+            json.dump(response, f, separators=(',', ':'))
+        return {"success": True, "output_path": destination}
+
+    shutil.move(response['output_path'], destination)
+    return dict(response, output_path=destination)
+
+
+def _label_value(value) -> str:
+    """A Prometheus label value with backslashes, quotes and newlines escaped"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ServerMetrics:
+    """Aggregates served requests and their timings for a Prometheus text dump"""
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # Actions get their own label; anything else a client sends is counted as 'unknown'
+    # so typos and hostile strings cannot mint new series
+    ACTIONS = ('landmarks', 'makeup', 'makeup_batch', 'enhance', 'ping')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = Counter()  # (action, status) -> count
+        self.latency_buckets = {}  # action -> per-bucket counts (non-cumulative)
+        self.latency_sum = Counter()
+        self.stage_seconds = Counter()
+        self.stage_requests = Counter()
+        self.events = Counter()
+
+    def observe(self, action: str, response: Dict, seconds: float) -> None:
+        """Record one finished request (its 'timings', if any, feed the stage totals)"""
+        action = action if action in self.ACTIONS else 'unknown'
+        status = 'ok' if response.get('success', True) else 'error'
+        timings = response.get('timings') or {}
+        with self._lock:
+            self.requests[(action, status)] += 1
+            buckets = self.latency_buckets.setdefault(action, [0] * (len(self.LATENCY_BUCKETS) + 1))
+            buckets[next((i for i, bound in enumerate(self.LATENCY_BUCKETS) if seconds <= bound),
+                         len(self.LATENCY_BUCKETS))] += 1
+            self.latency_sum[action] += seconds
+            for stage, ms in timings.get('stages', {}).items():
+                self.stage_seconds[stage] += ms / 1000
+                self.stage_requests[stage] += 1
+            self.events.update(timings.get('counters', {}))
+
+    def render(self, runner_stats: Optional[Dict] = None,
+               startup: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+        """Prometheus text exposition format (version 0.0.4)
+
+        startup maps a process ('main' or a worker pid) to its start-up timings.
+        """
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples, suffix: str = '') -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_label_value(val)}"' for key, val in labels)
+                sample = name + suffix
+                lines.append(f"{sample}{{{label_text}}} {value}" if label_text else f"{sample} {value}")
+
+        with self._lock:
+            metric('mediapipe_uptime_seconds', 'gauge', 'Seconds since the server started',
+                   [((), round(time.time() - self.started, 3))])
+            metric('mediapipe_requests_total', 'counter', 'Requests handled, by action and outcome',
+                   [((('action', action), ('status', status)), count)
+                    for (action, status), count in sorted(self.requests.items())])
+
+            histogram = []
+            for action, buckets in sorted(self.latency_buckets.items()):
+                cumulative = 0
+                for bound, count in zip(self.LATENCY_BUCKETS + ('+Inf',), buckets):
+                    cumulative += count
+                    histogram.append(((('action', action), ('le', bound)), cumulative))
+            metric('mediapipe_request_duration_seconds', 'histogram', 'Request latency, queueing included',
+                   histogram, suffix='_bucket')
+            for action in sorted(self.latency_buckets):
+                lines.append(f'mediapipe_request_duration_seconds_sum{{action="{_label_value(action)}"}} '
+                             f'{round(self.latency_sum[action], 6)}')
+                lines.append(f'mediapipe_request_duration_seconds_count{{action="{_label_value(action)}"}} '
+                             f'{sum(self.latency_buckets[action])}')
+
+            metric('mediapipe_stage_seconds_total', 'counter', 'Time spent per processing stage',
+                   [((('stage', stage),), round(seconds, 6)) for stage, seconds in sorted(self.stage_seconds.items())])
+            metric('mediapipe_stage_requests_total', 'counter', 'Requests that went through each stage',
+                   [((('stage', stage),), count) for stage, count in sorted(self.stage_requests.items())])
+            metric('mediapipe_events_total', 'counter', 'Faces found, cache hits/misses and effects applied',
+                   [((('event', event),), count) for event, count in sorted(self.events.items())])
+
+        if startup:
+            metric('mediapipe_startup_milliseconds', 'gauge', 'Time taken by each start-up step, per process',
+                   [((('process', process), ('step', step[:-3] if step.endswith('_ms') else step)), ms)
+                    for process, steps in sorted(startup.items()) for step, ms in sorted(steps.items())])
+        if runner_stats:
+            metric('mediapipe_worker_events_total', 'counter', 'Worker pool job outcomes and recycling',
+                   [((('event', event),), count) for event, count in sorted(runner_stats.items())])
+
+        return '\n'.join(lines) + '\n'
+
+
+class InlineJobRunner:
+    """Runs jobs synchronously on one resident processor, one at a time"""
+
+    def __init__(self, processor: MediaPipeFaceProcessor):
+        self.processor = processor
+        self.metrics = ServerMetrics()
+        # MediaPipe graphs are not thread-safe, so callers take turns
+        self._lock = threading.Lock()
+
+    def submit(self, action: str, image, config: Optional[Dict] = None,
+               options: Optional[Dict] = None) -> 'Future':
+        """Run a job now and return an already-completed future"""
+        from concurrent.futures import Future
+
+        future = Future()
+        try:
+            with self._lock:
+                response, _ = run_action(self.processor, action, image, config, options)
+            future.set_result(response)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        pass
+
+
+def _pool_worker_main(conn, processor_options: Dict) -> None:
+    """Worker process loop: own a processor and answer jobs sent over a pipe"""
+    # One core per worker; parallelism comes from the number of workers
+    cv2.setNumThreads(1)
+    processor = MediaPipeFaceProcessor(**processor_options)
+    processor.warmup()
+    conn.send(('ready', os.getpid(), startup_timings()))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        action, image, config, options = job
+        try:
+            response, _ = run_action(processor, action, image, config, options)
+        except Exception as e:
+            response = {"success": False, "error": str(e)}
+        conn.send(('result', response))
+
+    conn.close()
+
+
+class MediaPipeWorkerPool:
+    """Pre-forked pool of worker processes, each with its own FaceMesh/FaceDetection graphs
+
+    Jobs wait in a bounded queue (submit blocks or raises queue.Full when it
+    is full), every job has a timeout after which its worker is killed and
+    replaced, and workers are recycled after a fixed number of jobs. A
+    replacement that fails to start is retried with exponential backoff;
+    meanwhile that slot's jobs fail instead of waiting forever.
+    """
+
+    _STOP = object()
+
+    # Seconds before retrying a worker that failed to start, doubling up to the max
+    RESPAWN_BACKOFF = 1.0
+    RESPAWN_BACKOFF_MAX = 30.0
+
+    def __init__(self, num_workers: Optional[int] = None, max_queue_size: int = 64,
+                 job_timeout: float = 30.0, max_jobs_per_worker: int = 500,
+                 startup_timeout: float = 60.0, start_method: Optional[str] = None,
+                 processor_options: Optional[Dict] = None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.startup_timeout = startup_timeout
+        self.processor_options = processor_options or {}
+
+        import multiprocessing
+        if start_method is None:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self.stats = {'completed': 0, 'timeouts': 0, 'crashes': 0, 'recycled': 0, 'spawn_failures': 0}
+        self.metrics = ServerMetrics()
+        self._stats_lock = threading.Lock()
+
+        # Fork every worker up front so models are loaded before the first job
+        self._slots = [self._spawn_worker() for _ in range(self.num_workers)]
+        self._retry_at = [0.0] * self.num_workers
+        self._backoff = [self.RESPAWN_BACKOFF] * self.num_workers
+        self._dispatchers = []
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self._dispatch_loop, args=(index,),
+                                      name=f'mediapipe-dispatch-{index}', daemon=True)
+            thread.start()
+            self._dispatchers.append(thread)
+
+    def submit(self, action: str, image, config: Optional[Dict] = None, options: Optional[Dict] = None,
+               block: bool = True, timeout: Optional[float] = None) -> 'Future':
+        """Queue a job; blocks (or raises queue.Full) when the queue is full"""
+        if self._closed:
+            raise RuntimeError("Worker pool is shut down")
+
+        from concurrent.futures import Future
+        future = Future()
+        self._queue.put((future, (action, image, config, options)), block=block, timeout=timeout)
+        return future
+
+    def run(self, action: str, image, config: Optional[Dict] = None, options: Optional[Dict] = None) -> Dict:
+        """Submit a job and wait for its response"""
+        return self.submit(action, image, config, options).result()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs, drain the queue and stop all workers"""
+        if self._closed:
+            return
+        self._closed = True
+
+        for _ in self._dispatchers:
+            self._queue.put(self._STOP)
+        if wait:
+            for thread in self._dispatchers:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def worker_startup(self) -> Dict[str, Dict[str, float]]:
+        """Start-up timings reported by each running worker, keyed by its pid"""
+        return {str(slot['pid']): slot['startup'] for slot in list(self._slots) if slot is not None}
+
+    def _spawn_worker(self) -> Dict:
+        """Start a worker process and wait until its models are loaded"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_pool_worker_main, args=(child_conn, self.processor_options),
+                                        daemon=True)
+        process.start()
+        child_conn.close()
+
+        if not parent_conn.poll(self.startup_timeout):
+            process.kill()
+            parent_conn.close()
+            raise RuntimeError("Worker failed to start in time")
+        try:
+            _, pid, startup = parent_conn.recv()
+        except (EOFError, OSError):
+            # The worker died while loading (bad options, missing models, ...)
+            process.kill()
+            process.join()
+            parent_conn.close()
+            raise RuntimeError(f"Worker exited during start-up (exit code {process.exitcode})")
+
+        return {'process': process, 'conn': parent_conn, 'jobs': 0, 'pid': pid, 'startup': startup}
+
+    def _stop_worker(self, slot: Dict, graceful: bool) -> None:
+        """Stop a worker, politely if it is idle, otherwise by killing it"""
+        process, conn = slot['process'], slot['conn']
+        if graceful:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+
+    def _replace_worker(self, index: int, reason: str) -> None:
+        self._stop_worker(self._slots[index], graceful=(reason == 'recycled'))
+        self._slots[index] = None
+        with self._stats_lock:
+            self.stats[reason] += 1
+        self._respawn_worker(index)
+
+    def _respawn_worker(self, index: int) -> None:
+        """Start a worker in an empty slot, unless a failed attempt is still backing off"""
+        if time.monotonic() < self._retry_at[index]:
+            return
+        try:
+            self._slots[index] = self._spawn_worker()
+            self._backoff[index] = self.RESPAWN_BACKOFF
+        except Exception as e:
+            print(f"Error starting worker {index} (retrying in {self._backoff[index]:.0f}s): {str(e)}",
+                  file=sys.stderr)
+            with self._stats_lock:
+                self.stats['spawn_failures'] += 1
+            self._retry_at[index] = time.monotonic() + self._backoff[index]
+            self._backoff[index] = min(self._backoff[index] * 2, self.RESPAWN_BACKOFF_MAX)
+
+    def _dispatch_loop(self, index: int) -> None:
+        """Feed queued jobs to one worker, enforcing timeouts and recycling"""
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            future, job = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            if self._slots[index] is None:
+                self._respawn_worker(index)
+            if self._slots[index] is None:
+                future.set_exception(RuntimeError("No worker available: restarting it failed"))
+                continue
+
+            try:
+                self._dispatch(index, future, job)
+            except Exception as e:
+                # Never let one job take the dispatcher (and so the slot) down with it
+                print(f"Error dispatching job: {str(e)}", file=sys.stderr)
+                if not future.done():
+                    future.set_exception(e)
+
+        if self._slots[index] is not None:
+            self._stop_worker(self._slots[index], graceful=True)
+
+    def _dispatch(self, index: int, future: 'Future', job: Tuple) -> None:
+        """Run one job on a slot's worker, replacing the worker after timeouts, crashes and recycling"""
+        slot = self._slots[index]
+        try:
+            slot['conn'].send(job)
+            if not slot['conn'].poll(self.job_timeout):
+                future.set_exception(TimeoutError(f"Job exceeded {self.job_timeout}s timeout"))
+                self._replace_worker(index, 'timeouts')
+                return
+
+            _, response = slot['conn'].recv()
+        except (EOFError, BrokenPipeError, OSError) as e:
+            future.set_exception(RuntimeError(f"Worker crashed: {str(e) or type(e).__name__}"))
+            self._replace_worker(index, 'crashes')
+            return
+
+        future.set_result(response)
+        slot['jobs'] += 1
+        with self._stats_lock:
+            self.stats['completed'] += 1
+        if self.max_jobs_per_worker and slot['jobs'] >= self.max_jobs_per_worker:
+            self._replace_worker(index, 'recycled')
+
+
+class AsyncFaceService:
+    """asyncio front-end that overlaps the stages of concurrent requests
+
+    Reading, decoding, compositing, encoding and writing run on a thread
+    pool (OpenCV releases the GIL while it works), while landmark inference
+    is serialized on one dedicated thread because MediaPipe graphs are not
+    thread-safe. So one request can be decoding or encoding while another
+    is being meshed. Requests are cancelled like any asyncio task and may
+    carry a deadline, after which their pending stages are dropped.
+    """
+
+    # Responses for jobs that fail outright, matching run_action()
+    FAILURES = {
+        'landmarks': "No face detected",
+        'makeup': "Failed to apply makeup",
+        'enhance': "Failed to enhance features"
+    }
+    RESULT_PREFIXES = {'makeup': 'mediapipe-makeup', 'enhance': 'mediapipe-enhanced'}
+
+    def __init__(self, processor: MediaPipeFaceProcessor, io_threads: Optional[int] = None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.processor = processor
+        self._io = ThreadPoolExecutor(max_workers=io_threads or min(4, (os.cpu_count() or 1) + 1),
+                                      thread_name_prefix='mediapipe-io')
+        self._inference = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mediapipe-inference')
+
+    async def run(self, action: str, image, config: Optional[Dict] = None, options: Optional[Dict] = None,
+                  timeout: Optional[float] = None) -> Dict:
+        """Run one job like run_action() and return its response
+
+        timeout is the job's deadline in seconds; once it passes the job is
+        abandoned with a "Deadline exceeded" error. Cancelling the awaiting
+        task cancels the job (asyncio.CancelledError propagates).
+        """
+        import asyncio
+
+        options = options or {}
+        timings = RequestTimings()
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._pipeline(action, image, config, options, timings), timeout)
+        except asyncio.TimeoutError:
+            response = {"success": False, "error": "Deadline exceeded"}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error processing {action} job: {str(e)}", file=sys.stderr)
+            response = {"success": False, "error": self.FAILURES.get(action, str(e))}
+
+        if options.get('timings'):
+            timings.total_ms = (time.perf_counter() - started) * 1000
+            response = dict(response, timings=timings.as_dict())
+        return response
+
+    async def _pipeline(self, action: str, image, config: Optional[Dict], options: Dict,
+                        timings: RequestTimings) -> Dict:
+        processor = self.processor
+        if action not in self.FAILURES:
+            # Batch and unknown actions run whole on the inference thread
+            response, _ = await self._call(self._inference, timings, _run_action, processor, action, image,
+                                           config, options)
+            return response
+
+        in_memory = not isinstance(image, str)
+        if in_memory:
+            data, source = processor._as_buffer(image), '<buffer>'
+        else:
+            data, source = await self._call(self._io, timings, processor._read_image_bytes, image), image
+
+        decoded = data if isinstance(data, np.ndarray) else None
+        cache_key = await self._call(self._io, timings, processor._landmark_cache_key, data)
+        landmark_data = None
+        if action == 'landmarks':
+            # Landmarks need no pixels on a cache hit, so only a miss pays for the decode
+            landmark_data = await self._call(self._io, timings, processor._cached_landmarks, cache_key)
+        if landmark_data is None:
+            if decoded is None:
+                decoded = await self._call(self._io, timings, processor._decode_image, data, source)
+            landmark_data = await self._call(self._inference, timings, processor._detect_landmarks, data, decoded,
+                                             source, cache_key)
+        if not landmark_data:
+            return {"success": False, "error": self.FAILURES[action]}
+
+        if action == 'landmarks':
+            # Bad options (unknown regions, landmark format) keep their own message, as in run_action()
+            try:
+                indices = processor.region_subset(options['regions']) if options.get('regions') else None
+                return format_landmark_data(landmark_data, options.get('landmark_format', 'json'), indices)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}
+
+        composite = processor._composite_makeup if action == 'makeup' else processor._composite_enhancements
+        result_image = await self._call(self._io, timings, composite, decoded, landmark_data, config or {})
+
+        output_format = options.get('output_format', 'jpeg')
+        encoded = await self._call(self._io, timings, processor.encode_image, result_image, output_format,
+                                   options.get('quality'))
+        if in_memory:
+            return _encoded_response(encoded, output_format)
+
+        output_path = await self._call(self._io, timings, processor._write_result, encoded,
+                                       self.RESULT_PREFIXES[action], '', output_format)
+        return {"success": True, "output_path": output_path}
+
+    async def _call(self, executor: 'ThreadPoolExecutor', timings: RequestTimings, fn, *args):
+        """Run fn on executor with the request's timings active, recording time spent queued"""
+        import asyncio
+
+        queued = time.perf_counter()
+
+        def call():
+            with timings.attached():
+                timings.add('queue_wait', (time.perf_counter() - queued) * 1000)
+                return fn(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def close(self, wait: bool = True) -> None:
+        self._io.shutdown(wait=wait, cancel_futures=True)
+        self._inference.shutdown(wait=wait, cancel_futures=True)
+
+
+class AsyncJobRunner:
+    """Job runner for --serve backed by an AsyncFaceService on its own event loop thread
+
+    Jobs may set 'deadline_ms', and can be cancelled by the id they were
+    submitted with.
+    """
+
+    def __init__(self, processor: MediaPipeFaceProcessor, io_threads: Optional[int] = None):
+        import asyncio
+
+        self.service = AsyncFaceService(processor, io_threads)
+        self.metrics = ServerMetrics()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._jobs = {}  # job id (as JSON) -> Future
+        self._lock = threading.Lock()
+
+    def submit(self, action: str, image, config: Optional[Dict] = None,
+               options: Optional[Dict] = None) -> 'Future':
+        """Schedule a job on the event loop; the returned future can be cancelled"""
+        import asyncio
+
+        options = options or {}
+        timeout = options['deadline_ms'] / 1000 if options.get('deadline_ms') else None
+        future = asyncio.run_coroutine_threadsafe(
+            self.service.run(action, image, config, options, timeout), self._loop)
+
+        if options.get('job_id') is not None:
+            key = json.dumps(options['job_id'], sort_keys=True)
+            with self._lock:
+                self._jobs[key] = future
+
+            def forget(_):
+                with self._lock:
+                    if self._jobs.get(key) is future:
+                        del self._jobs[key]
+
+            future.add_done_callback(forget)
+        return future
+
+    def cancel(self, job_id) -> bool:
+        """Cancel a pending or running job by id; False if it is unknown or already done"""
+        with self._lock:
+            future = self._jobs.get(json.dumps(job_id, sort_keys=True))
+        return future.cancel() if future is not None else False
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.service.close(wait)
+        self._loop.close()
+
+
+# Length-prefixed framing used by --serve: 4-byte big-endian payload size
+# followed by one request or one response. Requests and most responses are
+# UTF-8 JSON documents, but a response to landmark_format 'binary' is packed
+# by pack_landmark_response(): clients must check the payload for a leading
+# LANDMARK_MAGIC (b'MPLM') before JSON-parsing it, and decode it with
+# unpack_landmark_response() or the layout documented there.
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def read_frame(stream) -> Optional[bytes]:
+    """Read one length-prefixed frame, returning None on clean EOF"""
+    header = stream.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("Truncated frame header")
+
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size} bytes")
+
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise EOFError("Truncated frame payload")
+    return payload
+
+
+def write_frame(stream, payload: bytes) -> None:
+    """Write one length-prefixed frame and flush it"""
+    stream.write(FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def runner_startup(runner) -> Dict[str, Dict[str, float]]:
+    """Start-up timings of this process ('main') and, for a worker pool, of each worker by pid"""
+    startup = {'main': startup_timings()}
+    if hasattr(runner, 'worker_startup'):
+        startup.update(runner.worker_startup())
+    return startup
+
+
+def submit_request(runner, payload: bytes) -> 'Future':
+    """Decode a framed JSON job and hand it to the runner
+
+    The returned future resolves to the JSON response (with the job's 'id'
+    echoed back), never to an exception. Every job is timed per stage for
+    the runner's metrics; the 'timings' key is dropped from its response
+    only if the job sets "timings": false.
+    """
+    from concurrent.futures import CancelledError, Future
+
+    response_future = Future()
+    started = time.perf_counter()
+    job = {}
+    job_id = None
+    action = None
+
+    def finish(response: Dict) -> None:
+        if action is not None:
+            runner.metrics.observe(str(action), response, time.perf_counter() - started)
+        if job.get('timings') is False:
+            response = {key: value for key, value in response.items() if key != 'timings'}
+        if job_id is not None:
+            response = dict(response, id=job_id)
+        response_future.set_result(response)
+
+    def on_done(job_future: 'Future') -> None:
+        try:
+            finish(job_future.result())
+        except CancelledError:
+            finish({"success": False, "error": "Cancelled"})
+        except Exception as e:
+            print(f"Error handling request: {str(e)}", file=sys.stderr)
+            finish({"success": False, "error": str(e) or type(e).__name__})
+
+    try:
+        parsed = json.loads(payload)
+        if not isinstance(parsed, dict):
+            raise ValueError("Job must be a JSON object")
+        job = parsed
+        job_id = job.get('id')
+        action = job.get('action')
+
+        # In-memory jobs send the encoded image inline instead of a path
+        image = job.get('image')
+        if job.get('image_b64'):
+            image = base64.b64decode(job['image_b64'])
+        options = {key: job[key] for key in ('output_format', 'quality', 'landmark_format', 'regions',
+                                             'profile_interval_ms', 'deadline_ms') if key in job}
+        options['timings'] = True
+        options['job_id'] = job_id
+
+        if action == 'ping':
+            response = {"success": True, "pong": True, "startup": startup_timings()}
+            if hasattr(runner, 'worker_startup'):
+                # Workers load mediapipe and warm up in their own processes
+                response['workers'] = runner.worker_startup()
+            finish(response)
+        elif action == 'cancel':
+            action = None
+            cancel = getattr(runner, 'cancel', None)
+            finish({"success": True, "cancelled": bool(cancel and cancel(job.get('target')))})
+        elif action == 'metrics':
+            action = None  # scrapes are not themselves counted
+            finish({"success": True, "content_type": "text/plain; version=0.0.4",
+                    "metrics": runner.metrics.render(getattr(runner, 'stats', None), runner_startup(runner))})
+        elif not image:
+            finish({"success": False, "error": "Missing 'image' or 'image_b64' in job"})
+        else:
+            runner.submit(action, image, job.get('config'), options).add_done_callback(on_done)
+
+    except Exception as e:
+        print(f"Error handling request: {str(e)}", file=sys.stderr)
+        finish({"success": False, "error": str(e)})
+
+    return response_future
+
+
+def serve_stdio(runner) -> None:
+    """Serve framed jobs over stdin/stdout until EOF or a shutdown job
+
+    With a worker pool, jobs are pipelined and responses may arrive out of
+    order; clients match them up using the job 'id'.
+    """
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    write_lock = threading.Lock()
+    pending = set()
+
+    # Anything printed by accident must not corrupt the frame stream
+    sys.stdout = sys.stderr
+
+    def respond(response_future: 'Future') -> None:
+        with write_lock:
+            write_frame(stdout, encode_response(response_future.result()))
+            pending.discard(response_future)
+
+    while True:
+        payload = read_frame(stdin)
+        if payload is None:
+            break
+        if _is_shutdown(payload):
+            break
+
+        response_future = submit_request(runner, payload)
+        with write_lock:
+            pending.add(response_future)
+        response_future.add_done_callback(respond)
+
+    # Let in-flight jobs finish before saying goodbye
+    for response_future in list(pending):
+        response_future.result()
+    if payload is not None:
+        with write_lock:
+            write_frame(stdout, json.dumps({"success": True, "shutdown": True}).encode('utf-8'))
+
+
+def serve_unix_socket(runner, socket_path: str) -> None:
+    """Serve framed jobs on a Unix domain socket, one thread per connection"""
+    import socketserver
+
+    class FrameHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    payload = read_frame(self.rfile)
+                except (EOFError, ValueError) as e:
+                    print(f"Dropping connection: {str(e)}", file=sys.stderr)
+                    return
+                if payload is None:
+                    return
+                if _is_shutdown(payload):
+                    write_frame(self.wfile, json.dumps({"success": True, "shutdown": True}).encode('utf-8'))
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+
+                response = submit_request(runner, payload).result()
+                write_frame(self.wfile, encode_response(response))
+
+    # Remove a stale socket left behind by a previous run
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, FrameHandler)
+    server.daemon_threads = True
+    print(f"MediaPipe face processor listening on {socket_path}", file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _is_shutdown(payload: bytes) -> bool:
+    """Check whether a framed job asks the server to stop"""
+    try:
+        return json.loads(payload).get('action') == 'shutdown'
+    except Exception:
+        return False
+
+
+def run_bulk_cli(args, processor_options: Dict) -> None:
+    """The bulk action: stream results to --output (or stdout) and print a throughput summary"""
+    try:
+        config = json.loads(args.config) if args.config else {}
+        jobs = load_bulk_jobs(args.input, args.bulk_action, config)
+    except (OSError, ValueError) as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+
+    done_keys = set() if args.overwrite else read_bulk_checkpoint(args.output)
+    options = {
+        'output_format': args.output_format,
+        'quality': args.quality,
+        'landmark_format': 'compact' if args.landmark_format == 'binary' else args.landmark_format,
+        'regions': args.regions
+    }
+
+    if args.workers > 0:
+        runner = MediaPipeWorkerPool(
+            num_workers=args.workers,
+            max_queue_size=args.queue_size,
+            job_timeout=args.job_timeout,
+            max_jobs_per_worker=args.max_jobs_per_worker,
+            processor_options=processor_options
+        )
+    else:
+        runner = InlineJobRunner(MediaPipeFaceProcessor(**processor_options))
+
+    results_stream = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        summary = run_bulk(runner, jobs, results_stream, options, done_keys, args.overwrite)
+    finally:
+        runner.shutdown()
+        if args.output:
+            results_stream.close()
+
+    # The summary goes to stdout unless the results themselves are streaming there
+    print(json.dumps({"success": summary['failed'] == 0, "summary": summary}),
+          file=sys.stdout if args.output else sys.stderr)
+    if summary['failed']:
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description='MediaPipe Face Processing')
-    parser.add_argument('--image', required=True, help='Input image path')
-    parser.add_argument('--action', required=True, choices=['landmarks', 'makeup', 'enhance'], help='Action to perform')
-    parser.add_argument('--config', help='JSON configuration for makeup/enhancement')
+    parser.add_argument('--image', help='Input image path')
+    parser.add_argument('--video', help='Input video path or camera index for the video action')
+    parser.add_argument('--output', help='Output path for the video action, or the JSONL results file for bulk')
+    parser.add_argument('--action', choices=['landmarks', 'makeup', 'makeup_batch', 'enhance', 'video', 'bulk'],
+                        help='Action to perform')
+    parser.add_argument('--input', help='For bulk, a directory of images or a JSONL manifest of jobs')
+    parser.add_argument('--bulk-action', default='makeup', choices=list(BULK_ACTIONS),
+                        help='For bulk, the action for directory inputs and manifest lines without one')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='For bulk, rerun jobs already done in --output and replace existing job outputs')
+    parser.add_argument('--config', help='JSON configuration for makeup/enhancement (a list of configs for makeup_batch)')
+    parser.add_argument('--output-format', default='jpeg', choices=['jpeg', 'webp', 'png'],
+                        help='Encoding for makeup/enhance results')
+    parser.add_argument('--quality', type=int,
+                        help='JPEG/WebP quality (0-100) or PNG compression level (0-9)')
+    parser.add_argument('--landmark-format', default='json', choices=list(LANDMARK_FORMATS),
+                        help='Landmarks output: indented JSON dicts, compact JSON rows, or packed binary')
+    parser.add_argument('--regions',
+                        help='Comma-separated regions (e.g. lips,left_eye) to limit landmarks output to')
+    parser.add_argument('--stream', action='store_true',
+                        help='For makeup_batch, print one JSON line per variant as soon as it is written')
+    parser.add_argument('--frame-skip', type=int, default=0,
+                        help='For video, drop this many input frames after each processed one')
+    parser.add_argument('--latency-budget-ms', type=float,
+                        help='For video, per-frame budget; over it, landmarks are re-inferred less often')
+    parser.add_argument('--no-smoothing', action='store_true',
+                        help='For video, disable temporal landmark smoothing and mask reuse')
+    parser.add_argument('--mask-reuse-threshold', type=float, default=1.0,
+                        help='For video, max landmark motion (px) under which region masks are reused')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep the models loaded and serve length-prefixed JSON jobs')
+    parser.add_argument('--socket', help='Unix socket path for --serve (default: stdin/stdout)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Serve with a pool of N worker processes (0 = single in-process model)')
+    parser.add_argument('--async-io', action='store_true',
+                        help='Serve in-process with an asyncio pipeline: I/O and codecs on threads '
+                             'overlapping serialized inference (supports cancel jobs and deadline_ms)')
+    parser.add_argument('--io-threads', type=int, help='Thread pool size for --async-io')
+    parser.add_argument('--queue-size', type=int, default=64, help='Max queued jobs before backpressure')
+    parser.add_argument('--job-timeout', type=float, default=30.0, help='Per-job timeout in seconds')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=500,
+                        help='Recycle a worker after this many jobs (0 = never)')
+    parser.add_argument('--timings', action='store_true',
+                        help="Add per-stage timings, counters and start-up steps to the JSON output under 'timings'")
+    parser.add_argument('--profile-interval-ms', type=float,
+                        help='Sample the Python stack at this interval and report the hottest stacks')
+    parser.add_argument('--max-faces', type=int, default=1,
+                        help='Detect and process up to this many faces (group photos)')
+    parser.add_argument('--working-resolution', type=int,
+                        help='For frames at least 3x this longest side, detect faces on a downscaled '
+                             'copy and mesh resized face crops instead of the full frame')
+    parser.add_argument('--antialias', action='store_true',
+                        help='Use sub-pixel, antialiased region masks for soft makeup edges')
+    parser.add_argument('--landmark-cache-dir',
+                        help='Enable the on-disk landmark cache tier in this directory (e.g. uploads/.landmark-cache)')
     
     args = parser.parse_args()
-    
-    processor = MediaPipeFaceProcessor()
-    
-    if args.action == 'landmarks':
-        landmarks = processor.detect_face_landmarks(args.image)
-        if landmarks:
-            print(json.dumps(landmarks, indent=2))
+
+    if args.action == 'video':
+        if not args.video:
+            parser.error('--video is required for the video action')
+    elif args.action == 'bulk':
+        if not args.input:
+            parser.error('--input is required for the bulk action')
+    elif not args.serve and not (args.image and args.action):
+        parser.error('--image and --action are required unless --serve is given')
+
+    processor_options = {
+        'landmark_cache_dir': args.landmark_cache_dir,
+        'max_num_faces': args.max_faces,
+        'antialias_masks': args.antialias,
+        'working_resolution': args.working_resolution
+    }
+
+    if args.action == 'bulk':
+        run_bulk_cli(args, processor_options)
+        return
+
+    if args.serve:
+        if args.workers > 0:
+            runner = MediaPipeWorkerPool(
+                num_workers=args.workers,
+                max_queue_size=args.queue_size,
+                job_timeout=args.job_timeout,
+                max_jobs_per_worker=args.max_jobs_per_worker,
+                processor_options=processor_options
+            )
         else:
-            print("No face detected")
-            sys.exit(1)
+            processor = MediaPipeFaceProcessor(**processor_options)
+            print(f"MediaPipe face processor warmed up: {json.dumps(processor.warmup())}", file=sys.stderr)
+            if args.async_io:
+                runner = AsyncJobRunner(processor, args.io_threads)
+            else:
+                runner = InlineJobRunner(processor)
+
+        try:
+            if args.socket:
+                serve_unix_socket(runner, args.socket)
+            else:
+                serve_stdio(runner)
+        finally:
+            runner.shutdown()
+        return
     
-    elif args.action == 'makeup':
-        config = json.loads(args.config) if args.config else {}
-        result_path = processor.apply_professional_makeup(args.image, config)
-        if result_path:
-            print(json.dumps({"success": True, "output_path": result_path}))
+    processor = MediaPipeFaceProcessor(**processor_options)
+    config = json.loads(args.config) if args.config else {}
+
+    if args.action == 'video':
+        summary = processor.process_video(
+            args.video, config, args.output,
+            frame_skip=args.frame_skip,
+            latency_budget_ms=args.latency_budget_ms,
+            smoothing=not args.no_smoothing,
+            tracker=None if args.no_smoothing else TemporalLandmarkTracker(
+                processor.region_indices, reuse_threshold_px=args.mask_reuse_threshold,
+                antialias=processor.antialias_masks)
+        )
+        if summary:
+            print(json.dumps(dict(summary, success=True)))
         else:
+            print(json.dumps({"success": False, "error": "Failed to process video"}))
+            sys.exit(1)
+        return
+
+    if args.action == 'makeup_batch' and args.stream:
+        rendered = 0
+        for index, output_path in processor.iter_makeup_batch(args.image, _batch_configs(config),
+                                                              args.output_format, args.quality):
+            rendered += 1
+            print(json.dumps({"index": index, "success": output_path is not None, "output_path": output_path}),
+                  flush=True)
+        if not rendered:
             print(json.dumps({"success": False, "error": "Failed to apply makeup"}))
             sys.exit(1)
-    
-    elif args.action == 'enhance':
-        config = json.loads(args.config) if args.config else {}
-        result_path = processor.enhance_facial_features(args.image, config)
-        if result_path:
-            print(json.dumps({"success": True, "output_path": result_path}))
+        return
+
+    options = {
+        'output_format': args.output_format,
+        'quality': args.quality,
+        'landmark_format': args.landmark_format,
+        'regions': args.regions,
+        'timings': args.timings,
+        'profile_interval_ms': args.profile_interval_ms
+    }
+    if args.regions:
+        try:
+            processor.region_subset(args.regions)
+        except ValueError as e:
+            parser.error(str(e))
+
+    response, ok = run_action(processor, args.action, args.image, config, options)
+    if args.timings and 'timings' in response:
+        response['timings']['startup'] = startup_timings()
+
+    if args.action == 'landmarks':
+        if ok and args.landmark_format == 'binary':
+            sys.stdout.buffer.write(encode_response(response))
+            sys.stdout.flush()
+        elif ok and args.landmark_format == 'compact':
+            print(json.dumps(response, separators=(',', ':')))
+        elif ok:
+            print(json.dumps(response, indent=2))
         else:
-            print(json.dumps({"success": False, "error": "Failed to enhance features"}))
+            print("No face detected")
+            sys.exit(1)
+    else:
+        print(json.dumps(response))
+        if not ok:
             sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
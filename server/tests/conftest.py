@@ -0,0 +1,18 @@
+"""Shared fixtures for the MediaPipe face processor tests"""
+
+import importlib.util
+import os
+
+import pytest
+
+PROCESSOR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'mediapipe-face-processor.py')
+
+
+@pytest.fixture(scope='session')
+def processor_module():
+    """mediapipe-face-processor.py, loaded by path (its hyphenated name rules out a plain import)"""
+    spec = importlib.util.spec_from_file_location('mediapipe_face_processor', PROCESSOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
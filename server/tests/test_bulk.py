@@ -0,0 +1,78 @@
+"""run_bulk accounting against a runner that finishes jobs on its own threads"""
+
+import io
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ThreadedRunner:
+    """Completes each job's future from a separate thread, like the worker pool's dispatchers"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.threads = []
+
+    def submit(self, action, image, config=None, options=None):
+        if image == 'reject':
+            raise RuntimeError("queue full")
+        future = Future()
+
+        def finish():
+            time.sleep(self.delay)
+            if image.startswith('bad'):
+                future.set_result({"success": False, "error": "No face detected"})
+            else:
+                future.set_result({"success": True, "output_path": f"uploads/{image}.jpg"})
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        self.threads.append(thread)
+        return future
+
+
+class SlowStream(io.StringIO):
+    """Results stream whose writes take a while, so callbacks lag behind their futures"""
+
+    def write(self, text):
+        time.sleep(0.02)
+        return super().write(text)
+
+
+def jobs_for(*images):
+    return [{'image': image, 'action': 'makeup', 'config': {'lipstick': {}}} for image in images]
+
+
+def test_summary_counts_every_job_after_its_callback(processor_module):
+    for _ in range(5):
+        stream = SlowStream()
+        summary = processor_module.run_bulk(ThreadedRunner(), jobs_for('a', 'bad-b', 'c'), stream)
+
+        results = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert len(results) == 3
+        assert summary['succeeded'] == 2
+        assert summary['failed'] == 1
+        assert summary['succeeded'] == sum(result['success'] for result in results)
+        assert 'p95_ms' in summary
+
+
+def test_submit_errors_are_reported_as_failures(processor_module):
+    stream = io.StringIO()
+    summary = processor_module.run_bulk(ThreadedRunner(), jobs_for('a', 'reject'), stream)
+
+    results = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert summary['succeeded'] == 1
+    assert summary['failed'] == 1
+    assert [result['error'] for result in results if not result['success']] == ["queue full"]
+
+
+def test_done_keys_are_skipped(processor_module):
+    jobs = jobs_for('a', 'b')
+    done = {processor_module.bulk_job_key(jobs[0])}
+    stream = io.StringIO()
+    summary = processor_module.run_bulk(ThreadedRunner(), jobs, stream, done_keys=done)
+
+    assert summary['skipped'] == 1
+    assert summary['succeeded'] == 1
+    assert [json.loads(line)['image'] for line in stream.getvalue().splitlines()] == ['b']
@@ -0,0 +1,69 @@
+"""Binary landmark responses: pack_landmark_response() and unpack_landmark_response()"""
+import json
+
+import numpy as np
+import pytest
+
+
+def _detection(processor_module, num_faces, points=468):
+    rng = np.random.default_rng(num_faces)
+    faces = [(rng.random((points, 3)) * [640, 480, 0.1]).astype(np.float32) for _ in range(num_faces)]
+    data = {
+        'landmarks': faces[0],
+        'total_points': points,
+        'image_size': {'width': 640, 'height': 480},
+        'confidence': 0.95,
+    }
+    if num_faces > 1:
+        data['num_faces'] = num_faces
+        data['faces'] = [{'landmarks': face, 'bbox': processor_module.landmark_bbox(face)} for face in faces]
+    return data
+
+
+def _round_trip(processor_module, data, indices=None):
+    response = dict(processor_module.format_landmark_data(data, 'binary', indices), success=True)
+    payload = processor_module.encode_response(response)
+    assert payload[:4] == processor_module.LANDMARK_MAGIC
+    return response, processor_module.unpack_landmark_response(payload)
+
+
+def test_single_face_round_trip(processor_module):
+    data = _detection(processor_module, 1)
+    response, unpacked = _round_trip(processor_module, data)
+
+    assert unpacked['landmarks'].dtype == np.float32
+    np.testing.assert_array_equal(unpacked['landmarks'], data['landmarks'])
+    assert 'faces' not in unpacked
+    assert {k: v for k, v in unpacked.items() if k != 'landmarks'} == \
+        {k: v for k, v in response.items() if k != 'landmarks'}
+
+
+def test_multi_face_round_trip(processor_module):
+    data = _detection(processor_module, 3)
+    response, unpacked = _round_trip(processor_module, data)
+
+    assert unpacked['num_faces'] == 3
+    np.testing.assert_array_equal(unpacked['landmarks'], data['faces'][0]['landmarks'])
+    for face, original in zip(unpacked['faces'], data['faces']):
+        np.testing.assert_array_equal(face['landmarks'], original['landmarks'])
+        assert face['bbox'] == original['bbox']
+
+
+def test_regions_round_trip(processor_module):
+    indices = processor_module.MediaPipeFaceProcessor().region_subset('lips,left_eye')
+    data = _detection(processor_module, 2)
+    response, unpacked = _round_trip(processor_module, data, indices)
+
+    assert unpacked['indices'] == indices.tolist()
+    assert unpacked['total_points'] == len(indices)
+    assert unpacked['landmarks'].shape == (len(indices), 3)
+    for face, original in zip(unpacked['faces'], data['faces']):
+        np.testing.assert_array_equal(face['landmarks'], original['landmarks'][indices])
+
+
+def test_json_payload_is_not_unpacked(processor_module):
+    payload = processor_module.encode_response({'success': False, 'error': 'No face detected'})
+    assert payload[:4] != processor_module.LANDMARK_MAGIC
+    assert json.loads(payload) == {'success': False, 'error': 'No face detected'}
+    with pytest.raises(ValueError):
+        processor_module.unpack_landmark_response(payload)
@@ -0,0 +1,45 @@
+"""Prometheus exposition from ServerMetrics"""
+
+
+def test_unknown_actions_share_one_label(processor_module):
+    metrics = processor_module.ServerMetrics()
+    metrics.observe('x"}\nmediapipe_fake 1\n#', {"success": False}, 0.01)
+    metrics.observe('makup', {"success": False}, 0.01)
+    metrics.observe('makeup', {"success": True}, 0.01)
+
+    text = metrics.render()
+    assert not any(line.startswith('mediapipe_fake') for line in text.splitlines())
+    assert 'mediapipe_requests_total{action="unknown",status="error"} 2' in text
+    assert 'mediapipe_requests_total{action="makeup",status="ok"} 1' in text
+
+
+def test_label_values_are_escaped(processor_module):
+    metrics = processor_module.ServerMetrics()
+    metrics.observe('landmarks', {"timings": {"stages": {'a"b\\c\nd': 5.0}}}, 0.01)
+
+    text = metrics.render()
+    assert 'mediapipe_stage_seconds_total{stage="a\\"b\\\\c\\nd"} 0.005' in text
+    # Every sample is still a single line: name, optional labels, value
+    for line in text.splitlines():
+        assert line.startswith(('#', 'mediapipe_'))
+
+
+def test_startup_timings_per_process(processor_module):
+    metrics = processor_module.ServerMetrics()
+    text = metrics.render(startup={'main': {'module_import_ms': 180.5},
+                                   '4242': {'mediapipe_import_ms': 1034.0, 'warmup_ms': 60.1}})
+
+    assert 'mediapipe_startup_milliseconds{process="main",step="module_import"} 180.5' in text
+    assert 'mediapipe_startup_milliseconds{process="4242",step="mediapipe_import"} 1034.0' in text
+    assert 'mediapipe_startup_milliseconds{process="4242",step="warmup"} 60.1' in text
+
+
+def test_pool_reports_worker_startup(processor_module):
+    with processor_module.MediaPipeWorkerPool(num_workers=1) as pool:
+        pong = processor_module.submit_request(pool, b'{"action": "ping"}').result()
+        scrape = processor_module.submit_request(pool, b'{"action": "metrics"}').result()
+
+    (pid, steps), = pong['workers'].items()
+    assert {'mediapipe_import_ms', 'warmup_ms'} <= set(steps)
+    assert f'mediapipe_startup_milliseconds{{process="{pid}",step="warmup"}}' in scrape['metrics']
+    assert 'mediapipe_startup_milliseconds{process="main",step="module_import"}' in scrape['metrics']